@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+import synthetic_city
+import underpass_detection
+
+
+def measure(results, stage, memory, fn, *args):
+    """
+    Function that runs one stage, records its time (and its peak memory) in results and returns its output.
+    The peak memory is traced by tracemalloc, so it covers Python and NumPy allocations but not those of GEOS.
+
+    Input:
+        results: A dictionary of the stage results {stage: {'seconds': ..., 'peak_mib': ...}}
+        stage: Stage name
+        memory: Whether to trace the peak memory (slower)
+        fn, *args: The stage function and its arguments
+    Output:
+        The output of fn(*args)
+    """
+    if memory:
+        tracemalloc.start()
+        start_mem = tracemalloc.get_traced_memory()[0]
+
+    start = time.perf_counter()
+    output = fn(*args)
+    seconds = time.perf_counter() - start
+
+    results[stage] = {'seconds': seconds}
+    if memory:
+        results[stage]['peak_mib'] = (tracemalloc.get_traced_memory()[1] - start_mem) / 2 ** 20
+        tracemalloc.stop()
+
+    return output
+
+
+def run_flat(data, eps, output_dir, memory, snap=False, coverage=False):
+    """
+    Function that runs the stages of the columnar pipeline used by underpass_detection_main
+
+    Input:
+        data: Loaded CityJSON data
+        eps: Minimum difference between roof and ground areas to consider an underpass
+        output_dir: Folder of the wkt output of stage 4)
+        memory: Whether to trace the peak memory of every stage
+        snap, coverage: Union options of stage 5) (see underpass_detection.detect_underpasses)
+                        -> default: False, False
+    Output:
+        results: A dictionary of the stage results {stage: {'seconds': ..., 'peak_mib': ...}}
+        n_underpasses: Number of City Objects with underpasses found
+    """
+    results = {}
+    u = underpass_detection
+    grid_size = u.snap_grid_size(data['transform']) if snap else None
+
+    flat = measure(results, '1) flat_boundaries', memory, u.flat_boundaries, data, u.ROOF_TYPES + u.GROUND_TYPES)
+    roof_flat = u.select_surfaces(flat, u.ROOF_TYPES)
+    ground_flat = u.select_surfaces(flat, u.GROUND_TYPES)
+    n_objs = len(flat['object_ids'])
+
+    v_coords = measure(results, '2) vertex_idx_to_coords', memory, u.vertex_idx_to_coords, data)
+
+    roof_geoms = measure(results, '3) flat_polygons (roof)', memory, u.flat_polygons, roof_flat, v_coords)
+    ground_geoms = measure(results, '3) flat_polygons (ground)', memory, u.flat_polygons, ground_flat, v_coords)
+
+    measure(results, '4) write_wkt_polygon (roof)', memory, u.write_wkt_polygon,
+            dict(zip(roof_flat['surface_ids'], roof_geoms)), os.path.join(output_dir, 'roof_pre_union.wkt'))
+
+    _, roof_area = measure(results, '5) cal_area_batch (roof)', memory, u.cal_area_batch,
+                           roof_geoms, u.surface_objects(roof_flat), n_objs, grid_size, coverage)
+    _, ground_area = measure(results, '5) cal_area_batch (ground)', memory, u.cal_area_batch,
+                             ground_geoms, u.surface_objects(ground_flat), n_objs, grid_size, coverage)
+
+    _, underpass, _ = measure(results, '6) diff_area_batch', memory, u.diff_area_batch, eps, roof_area, ground_area)
+
+    return results, int(underpass.sum())
+
+
+def run_overhang(data, eps, output_dir, memory):
+    """
+    Function that runs the stages of the overhang method (--method overhang of underpass_detection_main),
+    which matches the roof faces against the ground faces instead of merging surfaces
+
+    Input:
+        data: Loaded CityJSON data
+        eps: Minimum overhang area to consider an underpass
+        output_dir: Not used (no intermediate outputs)
+        memory: Whether to trace the peak memory of every stage
+    Output:
+        results: A dictionary of the stage results {stage: {'seconds': ..., 'peak_mib': ...}}
+        n_underpasses: Number of City Objects with underpasses found
+    """
+    results = {}
+    u = underpass_detection
+
+    flat = measure(results, '1) flat_boundaries', memory, u.flat_boundaries, data, u.ROOF_TYPES + u.GROUND_TYPES)
+    roof_flat = u.select_surfaces(flat, u.ROOF_TYPES)
+    ground_flat = u.select_surfaces(flat, u.GROUND_TYPES)
+
+    v_coords = measure(results, '2) vertex_idx_to_coords', memory, u.vertex_idx_to_coords, data)
+
+    _, _, _, underpass = measure(results, '6) overhang_batch', memory, u.overhang_batch, eps, roof_flat, ground_flat, v_coords)
+
+    return results, int(underpass.sum())
+
+
+def run_dict(data, eps, output_dir, memory):
+    """
+    Function that runs the stages of the dictionary based functions
+    (roof_boundaries, boundary_idx_to_coords, build_polygons, cal_area, diff_area)
+
+    Input:
+        data: Loaded CityJSON data
+        eps: Minimum difference between roof and ground areas to consider an underpass
+        output_dir: Folder of the wkt outputs of stages 4) ~ 6)
+        memory: Whether to trace the peak memory of every stage
+    Output:
+        results: A dictionary of the stage results {stage: {'seconds': ..., 'peak_mib': ...}}
+        n_underpasses: Number of City Objects with underpasses found
+    """
+    results = {}
+    u = underpass_detection
+
+    obj_roofs, roof_bounds = measure(results, '1) roof_boundaries', memory, u.roof_boundaries, data)
+    obj_grounds, ground_bounds = measure(results, '1) ground_boundaries', memory, u.ground_boundaries, data)
+
+    v_coords = measure(results, '2) vertex_idx_to_coords', memory, u.vertex_idx_to_coords, data)
+    measure(results, '2) boundary_idx_to_coords (roof)', memory, u.boundary_idx_to_coords, roof_bounds, v_coords)
+
+    roof_geoms = measure(results, '3) build_polygons (roof)', memory, u.build_polygons, roof_bounds, v_coords)
+    ground_geoms = measure(results, '3) build_polygons (ground)', memory, u.build_polygons, ground_bounds, v_coords)
+
+    measure(results, '4) write_wkt_polygon (roof)', memory, u.write_wkt_polygon, roof_geoms, os.path.join(output_dir, 'roof_pre_union.wkt'))
+
+    roof_union, roof_area = measure(results, '5) cal_area (roof)', memory, u.cal_area, obj_roofs, roof_geoms)
+    ground_union, ground_area = measure(results, '5) cal_area (ground)', memory, u.cal_area, obj_grounds, ground_geoms)
+
+    underpass_ids, _ = measure(results, '6) diff_area', memory, u.diff_area, eps, roof_area, ground_area, roof_union, ground_union,
+                              os.path.join(output_dir, 'underpass_obj.wkt'))
+
+    return results, len(underpass_ids)
+
+
+def benchmark(n_buildings, pipeline, eps, memory, city_kwargs, union_kwargs=None):
+    """
+    Function that generates a synthetic city, writes it to a temporary CityJSON file and runs the pipeline stages on it
+
+    Input:
+        n_buildings: Number of buildings of the synthetic city
+        pipeline: 'flat' (columnar pipeline of underpass_detection_main), 'overhang' (overhang method)
+                  or 'dict' (dictionary based functions)
+        eps: Minimum difference between roof and ground areas to consider an underpass
+        memory: Whether to trace the peak memory of every stage
+        city_kwargs: Options of the synthetic city (see synthetic_city.synthetic_buildings)
+        union_kwargs: Union options of the flat pipeline {'snap': ..., 'coverage': ...} (see run_flat)
+                      -> default: None (union_all in floating precision)
+    Output:
+        report: A dictionary with the size of the city, the stage results and the number of underpasses found / planted
+    """
+    city, underpass_ids = synthetic_city.synthetic_city(n_buildings, **city_kwargs)
+    n_vertices = len(city['vertices'])
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        input_file = os.path.join(output_dir, 'synthetic.city.json')
+        with open(input_file, 'w') as f:
+            json.dump(city, f)
+        del city
+
+        results = {}
+        data = measure(results, '0) load_cityjson', memory, underpass_detection.load_cityjson, input_file)
+
+        if pipeline == 'flat':
+            stage_results, n_found = run_flat(data, eps, output_dir, memory, **(union_kwargs or {}))
+        elif pipeline == 'overhang':
+            stage_results, n_found = run_overhang(data, eps, output_dir, memory)
+        else:
+            stage_results, n_found = run_dict(data, eps, output_dir, memory)
+        results.update(stage_results)
+
+    return {'buildings': n_buildings, 'vertices': n_vertices, 'pipeline': pipeline,
+            'stages': results, 'total_seconds': sum(r['seconds'] for r in results.values()),
+            'underpasses_found': n_found, 'underpasses_planted': len(underpass_ids),
+            'max_rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10}
+
+
+def print_report(report):
+    """
+    Prints the stage results of one benchmark run as a table
+    """
+    print(f"\n<{report['buildings']} buildings, {report['vertices']} vertices, {report['pipeline']} pipeline>")
+    for stage, r in report['stages'].items():
+        peak = f"{r['peak_mib']:10.1f} MiB" if 'peak_mib' in r else ''
+        print(f"{stage:36s} {r['seconds']:10.4f} s {report['buildings'] / max(r['seconds'], 1e-9):14.0f} buildings/s {peak}")
+    print(f"{'total':36s} {report['total_seconds']:10.4f} s")
+    print(f"underpasses found / planted: {report['underpasses_found']} / {report['underpasses_planted']}, max RSS: {report['max_rss_mib']:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the underpass detection pipeline on synthetic cities")
+
+    parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 10000, 100000], help="Numbers of buildings of the synthetic cities")
+    parser.add_argument("--pipeline", choices=['flat', 'overhang', 'dict'], default='flat',
+                        help="flat: columnar pipeline of underpass_detection_main / overhang: overhang method / "
+                             "dict: dictionary based functions (roof_boundaries, cal_area, ...)")
+    parser.add_argument("--eps", type=float, default=1e-8, help="Minimum difference between roof and ground areas to consider an underpass")
+    parser.add_argument("--memory", action='store_true', help="Trace the peak memory of every stage with tracemalloc (slower)")
+    parser.add_argument("--snap-grid", action='store_true', help="Snap the surfaces to the precision grid before merging them (flat pipeline)")
+    parser.add_argument("--union", choices=['unary', 'coverage'], default='unary', help="Union of the surfaces of a City Object (flat pipeline)")
+    parser.add_argument("--roof-faces", type=int, default=1, help="Number of roof faces (roof surfaces) per building")
+    parser.add_argument("--multisurface-fraction", type=float, default=0.0, help="Fraction of buildings with a MultiSurface instead of a Solid geometry")
+    parser.add_argument("--underpass-fraction", type=float, default=0.05, help="Fraction of buildings with an underpass")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file")
+
+    args = parser.parse_args()
+
+    city_kwargs = {'roof_faces': args.roof_faces, 'multisurface_fraction': args.multisurface_fraction,
+                   'underpass_fraction': args.underpass_fraction, 'seed': args.seed}
+
+    union_kwargs = {'snap': args.snap_grid, 'coverage': args.union == 'coverage'}
+
+    reports = []
+    for n_buildings in args.sizes:
+        report = benchmark(n_buildings, args.pipeline, args.eps, args.memory, city_kwargs, union_kwargs)
+        print_report(report)
+        reports.append(report)
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'options': vars(args), 'runs': reports}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,143 @@
+import numpy as np
 import shapely
-from shapely import wkt as shapely_wkt
-import pandas as pd
 import geopandas as gpd
-import csv
 import json
 import os
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+json_loads = orjson.loads if orjson is not None else json.loads  # parser of CityJSONSeq lines
+
+
+# 0) Load CityJSON data
+def load_cityjson(input_file, parser='auto'):
+    """
+    Function that loads a CityJSON file with the fastest available JSON parser
+    and decodes its vertices into a NumPy integer array instead of nested lists
+
+    Input:
+        input_file: CityJSON file name
+        parser: JSON parser to use ('auto', 'simdjson', 'orjson' or 'json')
+                -> default: 'auto' (simdjson, then orjson, then the standard library json)
+    Output:
+        input_data: Loaded CityJSON data, where input_data['vertices'] is a (number of vertices, 3) integer array
+    """
+    if parser == 'auto':
+        parser = 'simdjson' if simdjson is not None else 'orjson' if orjson is not None else 'json'
+
+    with open(input_file, 'rb') as f:
+        raw = f.read()
+
+    if parser == 'simdjson':
+        doc = simdjson.Parser().parse(raw)
+        input_data = {}
+        for key in doc.keys():
+            if key == 'vertices':
+                # Flatten the vertices straight into a buffer of int64 without creating Python ints
+                input_data[key] = vertices_to_array(np.frombuffer(doc[key].as_buffer(of_type='i'), dtype=np.int64))
+            else:
+                value = doc[key]
+                input_data[key] = value.as_dict() if isinstance(value, simdjson.Object) else value.as_list() if isinstance(value, simdjson.Array) else value
+    else:
+        input_data = orjson.loads(raw) if parser == 'orjson' else json.loads(raw)
+        input_data['vertices'] = vertices_to_array(input_data['vertices'])
+
+    return input_data
+
+
+def vertices_to_array(vertices):
+    """
+    Function that returns CityJSON vertices as a (number of vertices, 3) integer array,
+    using int32 when the quantized coordinates fit in it
+
+    Input:
+        vertices: CityJSON vertices [[x, y, z], ...] or a flat array of them
+    Output:
+        vertices: A (number of vertices, 3) int32 (or int64) array
+    """
+    vertices = np.asarray(vertices, dtype=np.int64).reshape(-1, 3)
+
+    int32 = np.iinfo(np.int32)
+    if vertices.size == 0 or (vertices.min() >= int32.min and vertices.max() <= int32.max):
+        vertices = vertices.astype(np.int32)
+
+    return vertices
+
+
+# Semantic surface types collected as outer ceiling surfaces
+OCS_TYPES = ('OuterCeilingSurface',)
+
 
 # 1) Create lists of outer ceiling surfaces per city object
+def surface_boundaries(input_data, surface_groups):
+    """
+    Function that returns dictionaries of semantic surfaces and their boundaries for several groups of
+    semantic surface types, collected in a single pass over the City Objects
+
+    Input:
+        input_data: Loaded CityJSON data
+        surface_groups: A dictionary mapping group names to the semantic surface types they collect
+                        {group_name: ('OuterCeilingSurface', ...)}
+    Output:
+        groups: A dictionary mapping group names to their (obj_surfs, surf_bounds) dictionaries
+                {group_name: (obj_surfs, surf_bounds)}
+                - obj_surfs: {city_object_id: [surface_id, ...]}
+                - surf_bounds: {surface_id: [[[vertex_index_1, vertex_index_2, ...]]]}
+                The depth of the boundaries array depends on its geometry type
+                - Solid -> 4
+                - MultiSurface --> 3
+    """
+    type_group = {}  # {semantic_surface_type: group_name}
+    for group, types in surface_groups.items():
+        for surf_type in types:
+            type_group[surf_type] = group
+
+    groups = {group: ({}, {}) for group in surface_groups}  # {group_name: (obj_surfs, surf_bounds)}
+
+    for i, cityobj in input_data['CityObjects'].items():
+        if len(cityobj['geometry']) == 0:
+            continue
+
+        geom = cityobj['geometry'][0]
+        type = geom['type']
+        if type == 'Solid':  # Array depth == 4
+            faces = geom['boundaries'][0]
+            smt_values = geom['semantics']['values'][0]
+        elif type == 'MultiSurface':  # Array depth == 3
+            faces = geom['boundaries']
+            smt_values = geom['semantics']['values']
+        else:
+            print(f'geometry type error : {type}')  # Returns an error massage if a geometry type is something else
+            continue
+
+        for obj_surfs, _ in groups.values():
+            obj_surfs[i] = []
+
+        smt_num = {}  # {semantic_surface_num: (group_name, surface_id)}
+        for num, surf in enumerate(geom['semantics']['surfaces']):
+            group = type_group.get(surf['type'])
+            if group is not None:
+                smt_num[num] = (group, surf['id'])
+                groups[group][0][i].append(surf['id'])
+                groups[group][1][surf['id']] = []
+
+        # Group faces by their semantic index in one sweep over the semantic values
+        for face, val in zip(faces, smt_values):
+            if val in smt_num:
+                group, id = smt_num[val]
+                groups[group][1][id].append(face)
+
+    return groups
+
+
 def ocs_boundaries(input_data):
     """
     Function that returns dictionaries of outer ceiling surfaces and their boundaries from CityJSON data
@@ -19,194 +149,209 @@ def ocs_boundaries(input_data):
                    {city_object_id: [outer_ceiling_surface_id, ...]}
         ocs_bounds: A dictionary mapping OuterCeilingSurface IDs to their boundaries
                      {outer_ceiling_surface_id: [[[vertex_index_1, vertex_index_2, ...]]]}
-                     The depth of the boundaries array depends on its geometry type
-                     - Solid -> 4
-                     - MultiSurface --> 3
     """
-    cityobjs = list(input_data['CityObjects'].keys())
-
-    obj_ocs = {}    # {city_object_id: [outer_ceiling_surface_id, ...]}
-    ocs_bounds = {}  # {outer_ceiling_surface_id: [[[vertex_index_1, vertex_index_2, ...]]]}
-
-    for i in cityobjs:
-        if len(input_data['CityObjects'][i]['geometry']) == 0:
-            continue
-        else:
-            type = input_data['CityObjects'][i]['geometry'][0]['type']
-            boundaries = input_data['CityObjects'][i]['geometry'][0]['boundaries']
-            smt_values = input_data['CityObjects'][i]['geometry'][0]['semantics']['values']
-            smt_surfaces = input_data['CityObjects'][i]['geometry'][0]['semantics']['surfaces']
-
-            ocs_num = {}  # {outer_ceiling_surface_num: outer_ceiling_surface_id}
-            for num, surf in enumerate(smt_surfaces):
-                if surf['type'] == 'OuterCeilingSurface':
-                    ocs_num[num] = surf['id']
-
-            obj_ocs[i] = list(ocs_num.values())
-
-            ocs_val = {}  # {outer_ceiling_surface_id: [value_1, value_2, ...] }
-            for num in list(ocs_num.keys()):
-                vals = []
-                if type == 'Solid':
-                    for id, val in enumerate(smt_values[0]):
-                        if val == num:
-                            vals.append(id)
-                elif type == 'MultiSurface':
-                    for id, val in enumerate(smt_values):
-                        if val == num:
-                            vals.append(id)
-                ocs_val[ocs_num[num]] = vals
-
-            for id in list(ocs_val.keys()):
-                bounds = []
-                for val in ocs_val[id]:
-                    if type == 'Solid':  # Array depth == 4
-                        bounds.append(boundaries[0][val])
-                    elif (type == 'MultiSurface'):  # Array depth == 3
-                        bounds.append(boundaries[val])
-                    else:
-                        print(f'geometry type error : {type}')  # Returns an error massage if a geometry type is something else
-                ocs_bounds[id] = bounds
-
-    return obj_ocs, ocs_bounds
+    return surface_boundaries(input_data, {'ocs': OCS_TYPES})['ocs']
 
 
 # 2) Translate vertex coordinates from indices
-def vertex_idx_to_coords(input_data):
+def vertex_idx_to_coords(input_data, dims=2):
     """
-    Function that returns a dictionary of vertex indices and their x, y coordinates from CityJSON data
+    Function that returns an array of vertex coordinates from CityJSON data,
+    where the row of each vertex is its vertex index
 
     Input:
-        Loaded CityJSON data
+        input_data: Loaded CityJSON data
+        dims: Number of coordinates kept per vertex (2 -> x, y / 3 -> x, y, z)
+              -> default: 2
     Output:
-        v_coords: A dictionary mapping vertex indices to their x, y coordinates
+        v_coords: A (number of vertices, dims) float64 array of vertex coordinates
                   (Coordinate translating formula: https://www.cityjson.org/specs/1.0.0/#transform-object)
     """
-    scale = input_data['transform']['scale']
-    translate = input_data['transform']['translate']
-    vertices = input_data['vertices']
+    scale = np.asarray(input_data['transform']['scale'][:dims], dtype=np.float64)
+    translate = np.asarray(input_data['transform']['translate'][:dims], dtype=np.float64)
+    vertices = np.asarray(input_data['vertices']).reshape(-1, 3)
 
-    v_coords = {}  # {vertex_idx: [x_coord, y_coord]}
-    for i in range(0, len(vertices)):
-        v_xy = []
-        v_x = (vertices[i][0] * scale[0]) + translate[0]
-        v_y = (vertices[i][1] * scale[1]) + translate[1]
+    v_coords = vertices[:, :dims] * scale + translate  # [[x_coord, y_coord], ...]
 
-        v_xy.append(v_x)
-        v_xy.append(v_y)
+    return np.ascontiguousarray(v_coords)
 
-        v_coords[i] = v_xy
 
-    return v_coords
-
-
-# 3) Get boundary coordinates
+# Get boundary coordinates
 def boundary_idx_to_coords(ocs_bounds, v_coords):
     """
     Function that returns a dictionary of outer ceiling surface IDs and their boundary coordinates
 
     Input:
         ocs_bounds: A dictionary of outer ceiling surface IDs and their boundary vertex indices
-        v_coords: A dictionary of vertex indices and their x, y coordinates
+        v_coords: An array of vertex coordinates indexed by vertex index
     Output:
         ocs_bounds_coords: A dictionary of outer ceiling surface IDs and their boundary coordinates
-                           {surface_id: [[[(v1_x, v1_y), (v2_x, v2_y), ...]]]}
+                           {surface_id: [[array([[v1_x, v1_y], [v2_x, v2_y], ...])]]}
     """
-    ocs_bounds_coords = {}  # {surface_id: [[[(v1_x, v1_y), (v2_x, v2_y), ...]]]}
+    ocs_bounds_coords = {}  # {surface_id: [[array([[v1_x, v1_y], [v2_x, v2_y], ...])]]}
 
     for uuid, bound in ocs_bounds.items():
         bound_coords =[]
         for face in bound:
             face_coords = []
             for ring in face:
-                ring_coords =[]
-                for v in ring:
-                    ring_coords.append(tuple(v_coords[v]))
-                face_coords.append(ring_coords)
+                face_coords.append(v_coords[ring])  # gather ring coordinates by fancy indexing
             bound_coords.append(face_coords)
         ocs_bounds_coords[uuid] = bound_coords
 
     return ocs_bounds_coords
 
 
-# 4) Output a shp file of outer ceiling surfaces for visualization
-def output_shp(obj_ocs, ocs_bounds_coords, output_file_nm):
+# 3) Build outer ceiling surface polygons from boundary vertex indices
+def build_polygons(ocs_bounds, v_coords):
     """
-    Function that outputs a shph file of outer ceiling surfce a for visualization
+    Function that builds (multi)polygons of outer ceiling surfaces directly from their boundary vertex indices,
+    using the vectorized Shapely constructors on the whole set of rings at once
 
     Input:
-        obj_ocs: A dictionary of City Objects and their outer ceiling surface IDs
-        ocs_bounds_coords: A dictionary of outer ceiling surface IDs and their boundary cooridnates
-        output_file_nm: Output shp file name
+        ocs_bounds: A dictionary of outer ceiling surface IDs and their boundary vertex indices
+        v_coords: An array of vertex coordinates indexed by vertex index
     Output:
-        output_shp: A SHP file to visualize each outer ceiling surface
+        ocs_geoms: A dictionary mapping outer ceiling surface IDs and their geometries
+                   {surface_id: (MULTI)POLYGON}
+                   A surface with a single face becomes a POLYGON, otherwise a MULTIPOLYGON
     """
-    ocs_bounds_wkts = {}  # {surface_id: '(MULTI)POLYGON((v1_x v1_y, v2_x v2_y, ...))}
+    ring_vertices = []  # vertex indices of all rings, concatenated
+    ring_sizes = []     # number of vertices per ring
+    face_sizes = []     # number of rings per face (the first ring is the exterior)
+    surf_sizes = []     # number of faces per surface
 
-    for uuid, bound in ocs_bounds_coords.items():
-        polygon_strs = []
+    for bound in ocs_bounds.values():
+        surf_sizes.append(len(bound))
         for face in bound:
-            ring_strs = []
+            face_sizes.append(len(face))
             for ring in face:
-                if ring[0] != ring[-1]:  # Close polygon
-                    ring.append(ring[0])
-                coords_list = []
-                for coord in ring:
-                    coords_list.append(f'{coord[0]} {coord[1]}')
-                coords = ', '.join(coords_list)
-                ring_strs.append(f'({coords})')
-            face_str = f"({', '.join(ring_strs)})"
-            polygon_strs.append(face_str)
-
-        if len(polygon_strs) == 1:
-            wkt = f'POLYGON{polygon_strs[0]}'
+                ring_vertices.extend(ring)
+                ring_sizes.append(len(ring))
+
+    ocs_geoms = np.empty(len(surf_sizes), dtype=object)
+    if len(face_sizes) > 0:
+        coords = v_coords[np.asarray(ring_vertices, dtype=np.intp)]
+        # Rings are closed by linearrings if the first vertex is not repeated at the end
+        rings = shapely.linearrings(coords, indices=np.repeat(np.arange(len(ring_sizes)), ring_sizes))
+        faces = shapely.polygons(rings, indices=np.repeat(np.arange(len(face_sizes)), face_sizes))
+
+        surf_sizes = np.asarray(surf_sizes)
+        face_surf = np.repeat(np.arange(len(surf_sizes)), surf_sizes)  # surface number of each face
+        shapely.multipolygons(faces, indices=face_surf, out=ocs_geoms)
+
+        single = surf_sizes == 1
+        first_face = np.cumsum(surf_sizes) - surf_sizes
+        ocs_geoms[single] = faces[first_face[single]]
+
+    return dict(zip(ocs_bounds.keys(), ocs_geoms))
+
+
+# Merge outer ceiling surfaces and calculate area for each City Object
+def ocs_union(obj_ocs, ocs_geoms):
+    """
+    Function that merges outer ceiling surfaces and calculates area for each City Object in memory
+
+    Input:
+        obj_ocs: A dictionary of City Objects and their outer ceiling surface IDs
+        ocs_geoms: A dictionary of outer ceiling surface IDs and their geometries
+    Output:
+        uuids: A list of City Object IDs that have outer ceiling surfaces
+        areas: An array of merged outer ceiling surface areas
+        geoms: An array of merged outer ceiling surface geometries
+    """
+    uuids = []
+    geoms = []
+
+    for uuid, surfs in obj_ocs.items():
+        # if City Object has no outer ceiling surfaces, skip
+        if len(surfs) == 0:
+            continue
+
+        # Case 1) A single outer ceiling surface city object
+        if len(surfs) == 1:
+            geom = ocs_geoms[surfs[0]]
+
+        # Case 2) Multiple outer ceiling surfaces city object
         else:
-            all_faces = ', '.join(polygon_strs)
-            wkt = f'MULTIPOLYGON({all_faces})'
+            geom = shapely.unary_union([ocs_geoms[surf] for surf in surfs])  # merge surfaces
+
+        uuids.append(uuid)
+        geoms.append(geom)
 
-        ocs_bounds_wkts[uuid] = wkt
+    geoms = np.asarray(geoms, dtype=object)
 
-    # write to csv first
-    output_file_path = f'{output_file_nm}.csv'
-    folder_path = os.path.dirname(output_file_path)
+    return uuids, shapely.area(geoms), geoms
+
+
+# Output formats {output_format: (OGR driver, file extension)}
+OUTPUT_FORMATS = {'shp': ('ESRI Shapefile', 'shp'),
+                  'gpkg': ('GPKG', 'gpkg'),
+                  'fgb': ('FlatGeobuf', 'fgb'),
+                  'parquet': (None, 'parquet')}  # GeoParquet is written by pyarrow
+
+
+# 4) Output a file of outer ceiling surfaces for visualization
+def output_file(obj_ocs, ocs_geoms, output_file_nm, output_format='shp'):
+    """
+    Function that outputs a file of outer ceiling surfaces for visualization,
+    with a GeoDataFrame built directly from the in-memory geometries and areas
+
+    Input:
+        obj_ocs: A dictionary of City Objects and their outer ceiling surface IDs
+        ocs_geoms: A dictionary of outer ceiling surface IDs and their geometries
+        output_file_nm: Output file name (without extension)
+        output_format: One of OUTPUT_FORMATS ('shp', 'gpkg', 'fgb' or 'parquet')
+                       -> default: 'shp'
+    Output:
+        output_file: A file of each City Object's merged outer ceiling surface and its area
+    """
+    driver, ext = OUTPUT_FORMATS[output_format]
+
+    uuids, areas, geoms = ocs_union(obj_ocs, ocs_geoms)
+
+    folder_path = os.path.dirname(output_file_nm)
     if folder_path and not os.path.exists(folder_path):
         os.makedirs(folder_path)
 
-    with open(output_file_path, 'w', newline='') as output_csv:
-        writer = csv.writer(output_csv)
-        writer.writerow(['uuid', 'area', 'geom'])
+    gdf = gpd.GeoDataFrame({'uuid': uuids, 'area': areas}, geometry=gpd.GeoSeries(geoms, crs='epsg:28992'), crs='epsg:28992')
 
-        for uuid, surfs in obj_ocs.items():
-            # if City Object has no outer ceiling surfaces, skip
-            if len(surfs) == 0:
-                continue
+    if output_format == 'parquet':
+        gdf.to_parquet(f'{output_file_nm}.{ext}', compression='zstd')
+    else:
+        gdf.to_file(f'{output_file_nm}.{ext}', driver=driver, engine='pyogrio')
 
-            geom = None
-            # Case 1) A single outer ceiling surface city object
-            if len(surfs) == 1:
-                geom = shapely_wkt.loads(ocs_bounds_wkts[surfs[0]])
+    print(f'{ext} file created')
 
-            # Case 2) Multiple outer ceiling surfaces city object
-            elif len(surfs) > 1:
-                polys = []
-                for i in range(0, len(surfs)):
-                    poly = shapely_wkt.loads(ocs_bounds_wkts[surfs[i]])
-                    polys.append(poly)
 
-                geom = shapely.unary_union(polys)  # merge surfaces
+def output_shp(obj_ocs, ocs_geoms, output_file_nm):
+    """
+    Function that outputs a shp file of outer ceiling surfaces for visualization (see output_file)
+    """
+    output_file(obj_ocs, ocs_geoms, output_file_nm, 'shp')
 
-            area = shapely.area(geom)
 
-            writer.writerow([uuid, area, geom])
+# Streaming input) Read a CityJSONSeq file feature by feature
+def read_cityjsonseq(input_file):
+    """
+    Generator that reads a CityJSONSeq (JSON Lines, https://www.cityjson.org/cityjsonseq/) file one line at a time
+    and yields each CityJSONFeature as a stand-alone CityJSON object with the transform of the header line
 
-    # write to shp and remove the created csv file
-    df = pd.read_csv(output_file_path)
-    df['geom'] = df['geom'].apply(shapely_wkt.loads)
-    gdf = gpd.GeoDataFrame(df, geometry=df['geom'], crs='epsg:28992')
-    gdf = gdf.drop(columns=['geom'])
-    gdf.to_file(f'{output_file_nm}.shp')
+    Input:
+        input_file: CityJSONSeq file name (*.city.jsonl)
+    Output:
+        feature_data: A CityJSON object holding the City Objects and vertices of one feature
+                      {'transform': ..., 'CityObjects': {...}, 'vertices': [...]}
+    """
+    with open(input_file) as f:
+        header = json_loads(f.readline())  # first line: CityJSON header with the transform
 
-    if os.path.exists(output_file_path):
-        os.remove(output_file_path)
+        for line in f:
+            if not line.strip():
+                continue
 
-    print('shp file created')
+            feature = json_loads(line)
+            yield {'type': 'CityJSON',
+                   'transform': header['transform'],
+                   'CityObjects': feature['CityObjects'],
+                   'vertices': feature['vertices']}
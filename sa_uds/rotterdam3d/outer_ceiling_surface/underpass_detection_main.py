@@ -1,18 +1,23 @@
 import argparse
 import sys
-import json
 import underpass_detection_ocs
 
 def main():
     parser = argparse.ArgumentParser(description="Detect buildings with underpasses")
 
-    parser.add_argument("inputfile", help="Input cityjson file (required)")
+    parser.add_argument("inputfile", help="Input cityjson file, or cityjsonseq file (*.jsonl) to process it feature by feature (required)")
+
+    parser.add_argument("--output-format", choices=['shp', 'gpkg', 'fgb', 'parquet'], default='shp', help="Format of the output file (shp: Shapefile, gpkg: GeoPackage, fgb: FlatGeobuf, parquet: GeoParquet)")
+    parser.add_argument("--parser", choices=['auto', 'simdjson', 'orjson', 'json'], default='auto', help="JSON parser for cityjson input (auto: fastest installed one)")
 
     args = parser.parse_args()
 
+    if args.inputfile.endswith('.jsonl'):
+        main_seq(args)
+        return
+
     try:
-        with open(args.inputfile) as f:
-            data = json.load(f)
+        data = underpass_detection_ocs.load_cityjson(args.inputfile, args.parser)
     except Exception as e:
         print(e)
         sys.exit()
@@ -23,11 +28,29 @@ def main():
     # 2) Translate vertex coordinates from indices
     v_coords = underpass_detection_ocs.vertex_idx_to_coords(data)
 
-    # 3) Get boundary coordinates
-    ocs_bounds_coords = underpass_detection_ocs.boundary_idx_to_coords(ocs_bounds, v_coords)
+    # 3) Build outer ceiling surface polygons from boundary vertex indices
+    ocs_geoms = underpass_detection_ocs.build_polygons(ocs_bounds, v_coords)
+
+    # 4) Generate a file of underpass surfaces and area
+    underpass_detection_ocs.output_file(obj_ocs, ocs_geoms, 'data/underpass', args.output_format)
+
+
+def main_seq(args):
+    """
+    Streaming mode for CityJSONSeq input: steps 1) ~ 3) run on every feature on its own,
+    so only the outer ceiling surface geometries are kept in memory until the shp file is written.
+    """
+    obj_ocs = {}
+    ocs_geoms = {}
+
+    for feature in underpass_detection_ocs.read_cityjsonseq(args.inputfile):
+        feature_obj_ocs, feature_ocs_bounds = underpass_detection_ocs.ocs_boundaries(feature)
+        v_coords = underpass_detection_ocs.vertex_idx_to_coords(feature)
+
+        obj_ocs.update(feature_obj_ocs)
+        ocs_geoms.update(underpass_detection_ocs.build_polygons(feature_ocs_bounds, v_coords))
 
-    # 4) Generate a shp file of underpass surfaces and area
-    underpass_detection_ocs.output_shp(obj_ocs, ocs_bounds_coords, 'data/underpass')
+    underpass_detection_ocs.output_file(obj_ocs, ocs_geoms, 'data/underpass', args.output_format)
 
 
 if __name__ == "__main__":
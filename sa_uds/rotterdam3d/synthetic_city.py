@@ -0,0 +1,224 @@
+import argparse
+import json
+import numpy as np
+
+SCALE = 0.001                          # transform scale (1 mm quantization, as in the 3D BAG)
+TRANSLATE = [92000.0, 437000.0, 0.0]   # transform translate (Rotterdam, EPSG:28992)
+SPACING = 40.0                         # distance between the buildings on the grid (m)
+
+
+# 1) Create the geometry of one building
+def building_faces(x, y, width, depth, height, roof_faces, underpass):
+    """
+    Function that returns the faces of a box-shaped building as rings of (x, y, z) coordinates with their semantic types.
+    A building with an underpass has a passage of a third of its width through the middle:
+    its roof covers the whole footprint, but its ground surface leaves out the passage.
+
+    Input:
+        x, y: Coordinates of the lower left corner of the footprint (relative to the transform translate)
+        width, depth, height: Size of the building
+        roof_faces: Number of roof faces (strips of the roof, each its own roof surface)
+        underpass: Whether the building has an underpass
+    Output:
+        faces: A list of (semantic_type, ring) [('GroundSurface', [(x, y, z), ...]), ...]
+    """
+    x1, y1 = x + width, y + depth
+
+    def rect(xa, ya, xb, yb, z, upward):
+        ring = [(xa, ya, z), (xb, ya, z), (xb, yb, z), (xa, yb, z)]
+        return ring if upward else ring[::-1]
+
+    faces = []
+    if underpass:
+        passage_start, passage_end = x + width / 3, x + 2 * width / 3
+        faces.append(('GroundSurface', rect(x, y, passage_start, y1, 0.0, False)))
+        faces.append(('GroundSurface', rect(passage_end, y, x1, y1, 0.0, False)))
+    else:
+        faces.append(('GroundSurface', rect(x, y, x1, y1, 0.0, False)))
+
+    strips = np.linspace(x, x1, roof_faces + 1)
+    for xa, xb in zip(strips[:-1], strips[1:]):
+        faces.append(('RoofSurface', rect(xa, y, xb, y1, height, True)))
+
+    corners = [(x, y), (x1, y), (x1, y1), (x, y1)]
+    for (xa, ya), (xb, yb) in zip(corners, corners[1:] + corners[:1]):
+        faces.append(('WallSurface', [(xa, ya, 0.0), (xb, yb, 0.0), (xb, yb, height), (xa, ya, height)]))
+
+    return faces
+
+
+def building_object(obj_id, faces, geom_type, vertex_index):
+    """
+    Function that returns a CityJSON City Object of a building from its faces
+
+    Input:
+        obj_id: City Object ID
+        faces: Faces returned by building_faces
+        geom_type: 'Solid' or 'MultiSurface'
+        vertex_index: A function that returns the vertex index of (x, y, z) coordinates
+    Output:
+        cityobj: A CityJSON City Object with one geometry, its semantic surfaces and its geographicalExtent
+    """
+    boundaries = []
+    surfaces = []
+    values = []
+    for num, (surf_type, ring) in enumerate(faces):
+        boundaries.append([[vertex_index(v) for v in ring]])
+        surfaces.append({'type': surf_type, 'id': f'{obj_id}_{num}'})
+        values.append(num)
+
+    coords = np.asarray([v for _, ring in faces for v in ring]) + TRANSLATE  # real-world coordinates
+    mins, maxs = coords.min(axis=0), coords.max(axis=0)
+
+    if geom_type == 'Solid':
+        boundaries, values = [boundaries], [values]
+
+    return {'type': 'Building',
+            'geographicalExtent': [float(mins[0]), float(mins[1]), float(mins[2]), float(maxs[0]), float(maxs[1]), float(maxs[2])],
+            'geometry': [{'type': geom_type, 'lod': '2.2', 'boundaries': boundaries,
+                          'semantics': {'surfaces': surfaces, 'values': values}}]}
+
+
+# 2) Create the City Objects of a whole synthetic city
+def synthetic_buildings(n_buildings, roof_faces=1, multisurface_fraction=0.0, underpass_fraction=0.05, seed=0):
+    """
+    Generator that yields the buildings of a synthetic city laid out on a square grid,
+    with random sizes and a controlled fraction of MultiSurface geometries and of underpasses
+
+    Input:
+        n_buildings: Number of buildings
+        roof_faces: Number of roof faces per building
+                    -> default: 1
+        multisurface_fraction: Fraction of buildings with a MultiSurface instead of a Solid geometry
+                               -> default: 0.0
+        underpass_fraction: Fraction of buildings with an underpass
+                            -> default: 0.05
+        seed: Seed of the random generator
+              -> default: 0
+    Output:
+        (city_object_id, faces, geom_type, underpass) for each building
+    """
+    rng = np.random.default_rng(seed)
+    grid = int(np.ceil(np.sqrt(n_buildings)))
+
+    sizes = rng.uniform(8.0, 30.0, size=(n_buildings, 2))
+    heights = rng.uniform(6.0, 40.0, size=n_buildings)
+    multisurface = rng.random(n_buildings) < multisurface_fraction
+    underpass = rng.random(n_buildings) < underpass_fraction
+
+    for num in range(n_buildings):
+        x = (num % grid) * SPACING
+        y = (num // grid) * SPACING
+        faces = building_faces(x, y, sizes[num, 0], sizes[num, 1], heights[num], roof_faces, underpass[num])
+        yield f'SYN_{num:07d}', faces, 'MultiSurface' if multisurface[num] else 'Solid', bool(underpass[num])
+
+
+def quantize(v):
+    """
+    Function that returns the quantized CityJSON vertex of (x, y, z) grid coordinates (relative to the transform translate)
+    """
+    return int(round(v[0] / SCALE)), int(round(v[1] / SCALE)), int(round(v[2] / SCALE))
+
+
+def vertex_indexer(vertices):
+    """
+    Function that returns a function giving the vertex index of (x, y, z) grid coordinates,
+    appending the quantized vertex to vertices the first time it is seen (shared vertices are stored once)
+    """
+    vertex_nums = {}  # {(x, y, z): vertex_index}
+
+    def vertex_index(v):
+        key = quantize(v)
+        if key not in vertex_nums:
+            vertex_nums[key] = len(vertices)
+            vertices.append(list(key))
+        return vertex_nums[key]
+
+    return vertex_index
+
+
+def synthetic_city(n_buildings, **kwargs):
+    """
+    Function that returns a synthetic CityJSON city (see synthetic_buildings for the options)
+
+    Input:
+        n_buildings: Number of buildings
+    Output:
+        city: CityJSON data {'type': 'CityJSON', 'transform': ..., 'CityObjects': {...}, 'vertices': [...]}
+        underpass_ids: IDs of the buildings with an underpass
+    """
+    vertices = []
+    vertex_index = vertex_indexer(vertices)
+
+    cityobjs = {}
+    underpass_ids = []
+    for obj_id, faces, geom_type, underpass in synthetic_buildings(n_buildings, **kwargs):
+        cityobjs[obj_id] = building_object(obj_id, faces, geom_type, vertex_index)
+        if underpass:
+            underpass_ids.append(obj_id)
+
+    city = {'type': 'CityJSON', 'version': '2.0',
+            'transform': {'scale': [SCALE] * 3, 'translate': TRANSLATE},
+            'metadata': {'referenceSystem': 'https://www.opengis.net/def/crs/EPSG/0/28992'},
+            'CityObjects': cityobjs, 'vertices': vertices}
+
+    return city, underpass_ids
+
+
+# 3) Write a synthetic city as CityJSON or CityJSONSeq
+def write_cityjsonseq(output_file, n_buildings, **kwargs):
+    """
+    Function that writes a synthetic city as a CityJSONSeq file (one CityJSONFeature per building),
+    building by building so that large cities do not have to fit in memory
+
+    Input:
+        output_file: CityJSONSeq file name (*.city.jsonl)
+        n_buildings: Number of buildings (see synthetic_buildings for the options)
+    Output:
+        underpass_ids: IDs of the buildings with an underpass
+    """
+    underpass_ids = []
+    with open(output_file, 'w') as f:
+        f.write(json.dumps({'type': 'CityJSON', 'version': '2.0',
+                            'transform': {'scale': [SCALE] * 3, 'translate': TRANSLATE},
+                            'metadata': {'referenceSystem': 'https://www.opengis.net/def/crs/EPSG/0/28992'},
+                            'CityObjects': {}, 'vertices': []}) + '\n')
+
+        for obj_id, faces, geom_type, underpass in synthetic_buildings(n_buildings, **kwargs):
+            vertices = []  # vertices of this feature only
+            cityobj = building_object(obj_id, faces, geom_type, vertex_indexer(vertices))
+            f.write(json.dumps({'type': 'CityJSONFeature', 'id': obj_id,
+                                'CityObjects': {obj_id: cityobj}, 'vertices': vertices}) + '\n')
+            if underpass:
+                underpass_ids.append(obj_id)
+
+    return underpass_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic CityJSON city of box-shaped buildings, some of them with an underpass")
+
+    parser.add_argument("outputfile", help="Output cityjson file, or cityjsonseq file (*.jsonl) (required)")
+    parser.add_argument("--buildings", type=int, default=1000, help="Number of buildings")
+    parser.add_argument("--roof-faces", type=int, default=1, help="Number of roof faces (roof surfaces) per building")
+    parser.add_argument("--multisurface-fraction", type=float, default=0.0, help="Fraction of buildings with a MultiSurface instead of a Solid geometry")
+    parser.add_argument("--underpass-fraction", type=float, default=0.05, help="Fraction of buildings with an underpass")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+
+    args = parser.parse_args()
+
+    kwargs = {'roof_faces': args.roof_faces, 'multisurface_fraction': args.multisurface_fraction,
+              'underpass_fraction': args.underpass_fraction, 'seed': args.seed}
+
+    if args.outputfile.endswith('.jsonl'):
+        underpass_ids = write_cityjsonseq(args.outputfile, args.buildings, **kwargs)
+    else:
+        city, underpass_ids = synthetic_city(args.buildings, **kwargs)
+        with open(args.outputfile, 'w') as f:
+            json.dump(city, f)
+
+    print(f'{args.buildings} buildings, {len(underpass_ids)} with an underpass written to {args.outputfile}')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,246 @@
+import hashlib
+import itertools
+import json
+from multiprocessing import shared_memory
+import os
+import sqlite3
+import numpy as np
 import shapely
-from shapely import wkt
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+try:
+    import geopandas as gpd
+except ImportError:
+    gpd = None
+
+json_loads = orjson.loads if orjson is not None else json.loads  # parser of CityJSONSeq lines
+
+WRITE_BUFFER_SIZE = 1 << 20  # buffer size of the output text files (bytes)
+
+
+# 0) Load CityJSON data
+def load_cityjson(input_file, parser='auto'):
+    """
+    Function that loads a CityJSON file with the fastest available JSON parser
+    and decodes its vertices into a NumPy integer array instead of nested lists
+
+    Input:
+        input_file: CityJSON file name
+        parser: JSON parser to use ('auto', 'simdjson', 'orjson' or 'json')
+                -> default: 'auto' (simdjson, then orjson, then the standard library json)
+    Output:
+        input_data: Loaded CityJSON data, where input_data['vertices'] is a (number of vertices, 3) integer array
+    """
+    if parser == 'auto':
+        parser = 'simdjson' if simdjson is not None else 'orjson' if orjson is not None else 'json'
+
+    with open(input_file, 'rb') as f:
+        raw = f.read()
+
+    if parser == 'simdjson':
+        doc = simdjson.Parser().parse(raw)
+        input_data = {}
+        for key in doc.keys():
+            if key == 'vertices':
+                # Flatten the vertices straight into a buffer of int64 without creating Python ints
+                input_data[key] = vertices_to_array(np.frombuffer(doc[key].as_buffer(of_type='i'), dtype=np.int64))
+            else:
+                value = doc[key]
+                input_data[key] = value.as_dict() if isinstance(value, simdjson.Object) else value.as_list() if isinstance(value, simdjson.Array) else value
+    else:
+        input_data = orjson.loads(raw) if parser == 'orjson' else json.loads(raw)
+        input_data['vertices'] = vertices_to_array(input_data['vertices'])
+
+    return input_data
+
+
+def vertices_to_array(vertices):
+    """
+    Function that returns CityJSON vertices as a (number of vertices, 3) integer array,
+    using int32 when the quantized coordinates fit in it
+
+    Input:
+        vertices: CityJSON vertices [[x, y, z], ...] or a flat array of them
+    Output:
+        vertices: A (number of vertices, 3) int32 (or int64) array
+    """
+    vertices = np.asarray(vertices, dtype=np.int64).reshape(-1, 3)
+
+    int32 = np.iinfo(np.int32)
+    if vertices.size == 0 or (vertices.min() >= int32.min and vertices.max() <= int32.max):
+        vertices = vertices.astype(np.int32)
+
+    return vertices
+
+
+# Area of interest) Keep only the City Objects within a bbox and/or a clip polygon
+def area_of_interest(bbox=None, clip_polygon=None):
+    """
+    Function that returns the area of interest as a single (prepared) Shapely geometry
+
+    Input:
+        bbox: [min_x, min_y, max_x, max_y]
+              -> default: None
+        clip_polygon: A Shapely (Multi)Polygon
+                      -> default: None
+    Output:
+        aoi: The bbox, the clip polygon or their intersection (None if neither is given)
+    """
+    aoi = None
+    if bbox is not None:
+        aoi = shapely.box(*bbox)
+    if clip_polygon is not None:
+        aoi = clip_polygon if aoi is None else shapely.intersection(aoi, clip_polygon)
+
+    if aoi is not None:
+        shapely.prepare(aoi)
+
+    return aoi
+
+
+def cityobject_extents(input_data, v_coords=None):
+    """
+    Function that returns the x, y extent of each City Object: its geographicalExtent,
+    or the extent of the vertices of its first geometry when it has none
+
+    Input:
+        input_data: Loaded CityJSON data
+        v_coords: An array of vertex coordinates indexed by vertex index
+                  -> default: None (computed from input_data by vertex_idx_to_coords, only if needed)
+    Output:
+        extents: A (number of City Objects, 4) array of [min_x, min_y, max_x, max_y] (NaN if no geometry)
+    """
+    extents = np.full((len(input_data['CityObjects']), 4), np.nan)
+
+    no_extent = []  # (City Object number, vertex indices) of the City Objects without geographicalExtent
+    for num, cityobj in enumerate(input_data['CityObjects'].values()):
+        extent = cityobj.get('geographicalExtent')  # [min_x, min_y, min_z, max_x, max_y, max_z]
+        if extent:
+            extents[num] = extent[0], extent[1], extent[3], extent[4]
+        elif cityobj.get('geometry'):
+            indices = cityobj['geometry'][0]['boundaries']
+            while len(indices) > 0 and isinstance(indices[0], list):  # flatten the nested boundaries
+                indices = list(itertools.chain.from_iterable(indices))
+            if len(indices) > 0:
+                no_extent.append((num, indices))
+
+    if len(no_extent) > 0:
+        if v_coords is None:
+            v_coords = vertex_idx_to_coords(input_data)
+
+        nums = [num for num, _ in no_extent]
+        sizes = [len(indices) for _, indices in no_extent]
+        coords = v_coords[np.fromiter(itertools.chain.from_iterable(indices for _, indices in no_extent), dtype=np.int64), :2]
+        starts = sizes_to_offsets(sizes)[:-1]
+        extents[nums, :2] = np.minimum.reduceat(coords, starts)
+        extents[nums, 2:] = np.maximum.reduceat(coords, starts)
+
+    return extents
+
+
+def select_area(input_data, aoi, v_coords=None):
+    """
+    Function that returns CityJSON data with only the City Objects whose extent intersects the area of interest,
+    so that the following steps only touch the area of interest.
+    The vertices are kept as they are, since the vertex indices of the City Objects refer to them.
+
+    Input:
+        input_data: Loaded CityJSON data
+        aoi: The area of interest returned by area_of_interest (None keeps every City Object)
+        v_coords: An array of vertex coordinates indexed by vertex index (see cityobject_extents)
+                  -> default: None
+    Output:
+        input_data: CityJSON data with the City Objects in the area of interest
+    """
+    if aoi is None:
+        return input_data
+
+    extents = cityobject_extents(input_data, v_coords)
+    keep = shapely.intersects(aoi, shapely.box(extents[:, 0], extents[:, 1], extents[:, 2], extents[:, 3]))
+    keep &= ~np.isnan(extents).any(axis=1)
+
+    cityobjs = {id: cityobj for (id, cityobj), k in zip(input_data['CityObjects'].items(), keep) if k}
+
+    return {**input_data, 'CityObjects': cityobjs}
+
+
+# Semantic surface types collected as roof, ground and outer ceiling surfaces
+ROOF_TYPES = ('RoofSurface', 'OuterFloorSurface')  # Consider 'RoofSurface' and 'OuterFloorSurface' as roof surface
+GROUND_TYPES = ('GroundSurface',)
+OCS_TYPES = ('OuterCeilingSurface',)
 
 
 # 1) Create lists of roofs and grounds per city object
+def surface_boundaries(input_data, surface_groups):
+    """
+    Function that returns dictionaries of semantic surfaces and their boundaries for several groups of
+    semantic surface types, collected in a single pass over the City Objects
+
+    Input:
+        input_data: Loaded CityJSON data
+        surface_groups: A dictionary mapping group names to the semantic surface types they collect
+                        {group_name: ('RoofSurface', 'OuterFloorSurface', ...)}
+    Output:
+        groups: A dictionary mapping group names to their (obj_surfs, surf_bounds) dictionaries
+                {group_name: (obj_surfs, surf_bounds)}
+                - obj_surfs: {city_object_id: [surface_id, ...]}
+                - surf_bounds: {surface_id: [[[vertex_index_1, vertex_index_2, ...]]]}
+                The depth of the boundaries array depends on its geometry type
+                - Solid -> 4
+                - MultiSurface --> 3
+    """
+    type_group = {}  # {semantic_surface_type: group_name}
+    for group, types in surface_groups.items():
+        for surf_type in types:
+            type_group[surf_type] = group
+
+    groups = {group: ({}, {}) for group in surface_groups}  # {group_name: (obj_surfs, surf_bounds)}
+
+    for i, cityobj in input_data['CityObjects'].items():
+        if len(cityobj['geometry']) == 0:
+            continue
+
+        geom = cityobj['geometry'][0]
+        type = geom['type']
+        if type == 'Solid':  # Array depth == 4
+            faces = geom['boundaries'][0]
+            smt_values = geom['semantics']['values'][0]
+        elif type == 'MultiSurface':  # Array depth == 3
+            faces = geom['boundaries']
+            smt_values = geom['semantics']['values']
+        else:
+            print(f'geometry type error : {type}')  # Returns an error massage if a geometry type is something else
+            continue
+
+        for obj_surfs, _ in groups.values():
+            obj_surfs[i] = []
+
+        smt_num = {}  # {semantic_surface_num: (group_name, surface_id)}
+        for num, surf in enumerate(geom['semantics']['surfaces']):
+            group = type_group.get(surf['type'])
+            if group is not None:
+                smt_num[num] = (group, surf['id'])
+                groups[group][0][i].append(surf['id'])
+                groups[group][1][surf['id']] = []
+
+        # Group faces by their semantic index in one sweep over the semantic values
+        for face, val in zip(faces, smt_values):
+            if val in smt_num:
+                group, id = smt_num[val]
+                groups[group][1][id].append(face)
+
+    return groups
+
+
 def roof_boundaries(input_data):
     """
     Function that returns dictionaries of roof surfaces and their boundaries from CityJSON data
@@ -14,57 +252,8 @@ def roof_boundaries(input_data):
                    {city_object_id: [roof_surface_id, ...]}
         roof_bounds: A dictionary mapping Roof Surface IDs to their boundaries
                      {roof_surface_id: [[[vertex_index_1, vertex_index_2, ...]]]}
-                     The depth of the boundaries array depends on its geometry type
-                     - Solid -> 4
-                     - MultiSurface --> 3
     """
-    cityobjs = list(input_data['CityObjects'].keys())
-
-    obj_roofs = {}    # {city_object_id: [roof_surface_id, ...]}
-    roof_bounds = {}  # {roof_surface_id: [[[vertex_index_1, vertex_index_2, ...]]]}
-
-    for i in cityobjs:
-        if len(input_data['CityObjects'][i]['geometry']) == 0:
-            continue
-        else:
-            type = input_data['CityObjects'][i]['geometry'][0]['type']
-            boundaries = input_data['CityObjects'][i]['geometry'][0]['boundaries']
-            smt_values = input_data['CityObjects'][i]['geometry'][0]['semantics']['values']
-            smt_surfaces = input_data['CityObjects'][i]['geometry'][0]['semantics']['surfaces']
-
-            roof_num = {}  # {roof_surface_num: roof_surface_id}
-            for num, surf in enumerate(smt_surfaces):
-                # Consider 'RoofSurface' and 'OuterFloorSurface' as roof surface
-                if (surf['type'] == 'RoofSurface') or (surf['type'] == 'OuterFloorSurface'):
-                    roof_num[num] = surf['id']
-
-            obj_roofs[i] = list(roof_num.values())
-
-            roof_val = {}  # {roof_surface_id: [value_1, value_2, ...] }
-            for num in list(roof_num.keys()):
-                vals = []
-                if type == 'Solid':
-                    for id, val in enumerate(smt_values[0]):
-                        if val == num:
-                            vals.append(id)
-                elif type == 'MultiSurface':
-                    for id, val in enumerate(smt_values):
-                        if val == num:
-                            vals.append(id)
-                roof_val[roof_num[num]] = vals
-
-            for id in list(roof_val.keys()):
-                bounds = []
-                for val in roof_val[id]:
-                    if type == 'Solid':  # Array depth == 4
-                        bounds.append(boundaries[0][val])
-                    elif (type == 'MultiSurface'):  # Array depth == 3
-                        bounds.append(boundaries[val])
-                    else:
-                        print(f'geometry type error : {type}')  # Returns an error massage if a geometry type is something else
-                roof_bounds[id] = bounds
-
-    return obj_roofs, roof_bounds
+    return surface_boundaries(input_data, {'roof': ROOF_TYPES})['roof']
 
 
 def ground_boundaries(input_data):
@@ -78,165 +267,412 @@ def ground_boundaries(input_data):
                      {city_object_id: [ground_surface_id, ...]}
         ground_bounds: A dictionary mapping Ground Surface IDs to their boundaries
                        {ground_surface_id: [[[vertex_index_1, vertex_index_2, ...]]]}
-                       The depth of the boundaries array depends on its geometry type
-                       - Solid -> 4
-                       - MultiSurface --> 3
     """
-    cityobjs = list(input_data['CityObjects'].keys())
+    return surface_boundaries(input_data, {'ground': GROUND_TYPES})['ground']
+
+
+def flat_boundaries(input_data, surface_types):
+    """
+    Function that returns the boundaries of the semantic surfaces of the given types in a columnar representation,
+    collected in a single pass over the City Objects.
+    Instead of nested lists, the vertex indices of all rings are stored in one flat array,
+    and each level (ring, face, surface, City Object) is described by an offset array into the level below.
+
+    Input:
+        input_data: Loaded CityJSON data
+        surface_types: Semantic surface types to collect ('RoofSurface', 'GroundSurface', ...)
+    Output:
+        flat: A dictionary of the columnar boundaries
+              - 'vertices': int32 vertex indices of all rings, concatenated
+              - 'ring_offsets': Start of each ring in 'vertices' (number of rings + 1)
+              - 'face_offsets': Start of each face in the rings (number of faces + 1), the first ring is the exterior
+              - 'surface_offsets': Start of each surface in the faces (number of surfaces + 1)
+              - 'object_offsets': Start of each City Object in the surfaces (number of City Objects + 1)
+              - 'face_types': Semantic type code of each face (index into 'types')
+              - 'surface_types': Semantic type code of each surface (index into 'types')
+              - 'surface_ids': Surface IDs [surface_id, ...]
+              - 'object_ids': City Object IDs [city_object_id, ...]
+              - 'object_extents': geographicalExtent of each City Object as [min_x, min_y, max_x, max_y] (NaN if absent)
+              - 'types': The semantic surface types of the type codes
+    """
+    surface_types = tuple(surface_types)
+    type_code = {surf_type: code for code, surf_type in enumerate(surface_types)}  # {semantic_surface_type: code}
 
-    obj_grounds = {}    # {city_object_id: [ground_surface_id, ...]}
-    ground_bounds = {}  # {ground_surface_id: [[[vertex_index_1, vertex_index_2, ...]]]}
+    vertices = []       # vertex indices of all rings, concatenated
+    ring_sizes = []     # number of vertices per ring
+    face_sizes = []     # number of rings per face
+    surf_sizes = []     # number of faces per surface
+    obj_sizes = []      # number of surfaces per City Object
+    surf_codes = []     # semantic type code per surface
+    surface_ids = []
+    object_ids = []
+    object_extents = []  # [[min_x, min_y, max_x, max_y], ...]
 
-    for i in cityobjs:
-        if len(input_data['CityObjects'][i]['geometry']) == 0:
+    for i, cityobj in input_data['CityObjects'].items():
+        if len(cityobj['geometry']) == 0:
             continue
+
+        geom = cityobj['geometry'][0]
+        type = geom['type']
+        if type == 'Solid':  # Array depth == 4
+            faces = geom['boundaries'][0]
+            smt_values = geom['semantics']['values'][0]
+        elif type == 'MultiSurface':  # Array depth == 3
+            faces = geom['boundaries']
+            smt_values = geom['semantics']['values']
         else:
-            type = input_data['CityObjects'][i]['geometry'][0]['type']
-            boundaries = input_data['CityObjects'][i]['geometry'][0]['boundaries']
-            smt_values = input_data['CityObjects'][i]['geometry'][0]['semantics']['values']
-            smt_surfaces = input_data['CityObjects'][i]['geometry'][0]['semantics']['surfaces']
-
-            ground_num = {}  # {ground_surface_num: ground_surface_id}
-            for num, surf in enumerate(smt_surfaces):
-                # Consider 'GroundSurface' as ground surface
-                if surf['type'] == 'GroundSurface':
-                    ground_num[num] = surf['id']
-
-            obj_grounds[i] = list(ground_num.values())
-
-            ground_val = {}  # {ground_surface_id: [value_1, value_2, ...] }
-            for num in list(ground_num.keys()):
-                vals = []
-                if type == 'Solid':
-                    for id, val in enumerate(smt_values[0]):
-                        if val == num:
-                            vals.append(id)
-                elif type == 'MultiSurface':
-                    for id, val in enumerate(smt_values):
-                        if val == num:
-                            vals.append(id)
-                ground_val[ground_num[num]] = vals
-
-            for id in list(ground_val.keys()):
-                bounds = []
-                for val in ground_val[id]:
-                    if type == 'Solid':   # Array depth == 4
-                        bounds.append(boundaries[0][val])
-                    elif type == 'MultiSurface':  # Array depth == 3
-                        bounds.append(boundaries[val])
-                    else:
-                        print(f'geometry type error : {type}')  # Returns an error massage if a geometry type is something else
-                ground_bounds[id] = bounds
-
-    return obj_grounds, ground_bounds
+            print(f'geometry type error : {type}')  # Returns an error massage if a geometry type is something else
+            continue
 
+        extent = cityobj.get('geographicalExtent')  # [min_x, min_y, min_z, max_x, max_y, max_z]
+        object_extents.append([extent[0], extent[1], extent[3], extent[4]] if extent else [np.nan] * 4)
 
-# 2) Translate vertex coordinates from indices
-def vertex_idx_to_coords(input_data):
+        smt_faces = {}  # {semantic_surface_num: [face, ...]}
+        for num, surf in enumerate(geom['semantics']['surfaces']):
+            code = type_code.get(surf['type'])
+            if code is not None:
+                smt_faces[num] = []
+                surf_codes.append(code)
+                surface_ids.append(surf['id'])
+
+        # Group faces by their semantic index in one sweep over the semantic values
+        for face, val in zip(faces, smt_values):
+            if val in smt_faces:
+                smt_faces[val].append(face)
+
+        for surf_faces in smt_faces.values():
+            surf_sizes.append(len(surf_faces))
+            for face in surf_faces:
+                face_sizes.append(len(face))
+                for ring in face:
+                    vertices.extend(ring)
+                    ring_sizes.append(len(ring))
+
+        obj_sizes.append(len(smt_faces))
+        object_ids.append(i)
+
+    surf_codes = np.asarray(surf_codes, dtype=np.int8)
+
+    return {'vertices': np.asarray(vertices, dtype=np.int32),
+            'ring_offsets': sizes_to_offsets(ring_sizes),
+            'face_offsets': sizes_to_offsets(face_sizes),
+            'surface_offsets': sizes_to_offsets(surf_sizes),
+            'object_offsets': sizes_to_offsets(obj_sizes),
+            'face_types': np.repeat(surf_codes, surf_sizes),
+            'surface_types': surf_codes,
+            'surface_ids': surface_ids,
+            'object_ids': object_ids,
+            'object_extents': np.asarray(object_extents, dtype=np.float64).reshape(-1, 4),
+            'types': surface_types}
+
+
+def select_surfaces(flat, surface_types):
     """
-    Function that returns a dictionary of vertex indices and their x, y coordinates from CityJSON data
+    Function that returns the columnar boundaries of the surfaces of the given semantic types only,
+    keeping every City Object (with no surfaces if it has none of these types)
 
     Input:
-        Loaded CityJSON data
+        flat: Columnar boundaries returned by flat_boundaries
+        surface_types: Semantic surface types to keep
     Output:
-        v_coords: A dictionary mapping vertex indices to their x, y coordinates
-                  (Coordinate translating formula: https://www.cityjson.org/specs/1.0.0/#transform-object)
+        flat_selected: Columnar boundaries of the selected surfaces (same keys as flat)
+    """
+    codes = [code for code, surf_type in enumerate(flat['types']) if surf_type in surface_types]
+
+    keep_surf = np.isin(flat['surface_types'], codes)
+    keep_obj = np.ones(len(flat['object_ids']), dtype=bool)
+
+    return subset_boundaries(flat, keep_surf, keep_obj)
+
+
+def select_objects(flat, keep_obj):
+    """
+    Function that returns the columnar boundaries of the given City Objects only
+
+    Input:
+        flat: Columnar boundaries returned by flat_boundaries / select_surfaces
+        keep_obj: A boolean array, True for the City Objects to keep
+    Output:
+        flat_selected: Columnar boundaries of the selected City Objects (same keys as flat)
+    """
+    keep_obj = np.asarray(keep_obj, dtype=bool)
+    keep_surf = np.repeat(keep_obj, np.diff(flat['object_offsets']))
+
+    return subset_boundaries(flat, keep_surf, keep_obj)
+
+
+def subset_boundaries(flat, keep_surf, keep_obj):
+    """
+    Function that returns the columnar boundaries of the kept surfaces of the kept City Objects,
+    with the offset arrays of every level recomputed
+
+    Input:
+        flat: Columnar boundaries returned by flat_boundaries
+        keep_surf: A boolean array, True for the surfaces to keep
+        keep_obj: A boolean array, True for the City Objects to keep (their surfaces must be kept or dropped as well)
+    Output:
+        flat_selected: Columnar boundaries of the kept surfaces and City Objects (same keys as flat)
+    """
+    ring_sizes = np.diff(flat['ring_offsets'])
+    face_sizes = np.diff(flat['face_offsets'])
+    surf_sizes = np.diff(flat['surface_offsets'])
+
+    keep_face = np.repeat(keep_surf, surf_sizes)
+    keep_ring = np.repeat(keep_face, face_sizes)
+    keep_vertex = np.repeat(keep_ring, ring_sizes)
+
+    obj_sizes = np.bincount(surface_objects(flat)[keep_surf], minlength=len(flat['object_ids']))
+
+    return {'vertices': flat['vertices'][keep_vertex],
+            'ring_offsets': sizes_to_offsets(ring_sizes[keep_ring]),
+            'face_offsets': sizes_to_offsets(face_sizes[keep_face]),
+            'surface_offsets': sizes_to_offsets(surf_sizes[keep_surf]),
+            'object_offsets': sizes_to_offsets(obj_sizes[keep_obj]),
+            'face_types': flat['face_types'][keep_face],
+            'surface_types': flat['surface_types'][keep_surf],
+            'surface_ids': [id for id, keep in zip(flat['surface_ids'], keep_surf) if keep],
+            'object_ids': [id for id, keep in zip(flat['object_ids'], keep_obj) if keep],
+            'object_extents': flat['object_extents'][keep_obj],
+            'types': flat['types']}
+
+
+def sizes_to_offsets(sizes):
+    """
+    Function that returns the offsets [0, size_1, size_1 + size_2, ...] of consecutive groups of the given sizes
+    """
+    return np.concatenate(([0], np.cumsum(sizes, dtype=np.int64)))
+
+
+def surface_objects(flat):
+    """
+    Function that returns the City Object number of each surface of columnar boundaries
     """
-    scale = input_data['transform']['scale']
-    translate = input_data['transform']['translate']
-    vertices = input_data['vertices']
+    return np.repeat(np.arange(len(flat['object_ids'])), np.diff(flat['object_offsets']))
 
-    v_coords = {}  # {vertex_idx: [x_coord, y_coord]}
-    for i in range(0, len(vertices)):
-        v_xy = []
-        v_x = (vertices[i][0] * scale[0]) + translate[0]
-        v_y = (vertices[i][1] * scale[1]) + translate[1]
 
-        v_xy.append(v_x)
-        v_xy.append(v_y)
+# 2) Translate vertex coordinates from indices
+def vertex_idx_to_coords(input_data, dims=2):
+    """
+    Function that returns an array of vertex coordinates from CityJSON data,
+    where the row of each vertex is its vertex index
+
+    Input:
+        input_data: Loaded CityJSON data
+        dims: Number of coordinates kept per vertex (2 -> x, y / 3 -> x, y, z)
+              -> default: 2
+    Output:
+        v_coords: A (number of vertices, dims) float64 array of vertex coordinates
+                  (Coordinate translating formula: https://www.cityjson.org/specs/1.0.0/#transform-object)
+    """
+    scale = np.asarray(input_data['transform']['scale'][:dims], dtype=np.float64)
+    translate = np.asarray(input_data['transform']['translate'][:dims], dtype=np.float64)
+    vertices = np.asarray(input_data['vertices']).reshape(-1, 3)
 
-        v_coords[i] = v_xy
+    v_coords = vertices[:, :dims] * scale + translate  # [[x_coord, y_coord], ...]
 
-    return v_coords
+    return np.ascontiguousarray(v_coords)
 
 
-# 3) Get boundary coordinates
+# Get boundary coordinates
 def boundary_idx_to_coords(surf_bounds, v_coords):
     """
     Function that returns a dictionary of surface IDs and their boundary coordinates
 
     Input:
         surf_bounds: A dictionary of roof/ground surface IDs and their boundary vertex indices
-        v_coords: A dictionary of vertex indices and their x, y coordinates
+        v_coords: An array of vertex coordinates indexed by vertex index
     Output:
         surf_bounds_coords: A dictionary of roof/ground surface IDs and their boundary coordinates
-                       {surface_id: [[[(v1_x, v1_y), (v2_x, v2_y), ...]]]}
+                       {surface_id: [[array([[v1_x, v1_y], [v2_x, v2_y], ...])]]}
     """
-    surf_bounds_coords = {}  # {surface_id: [[[(v1_x, v1_y), (v2_x, v2_y), ...]]]}
+    surf_bounds_coords = {}  # {surface_id: [[array([[v1_x, v1_y], [v2_x, v2_y], ...])]]}
 
     for uuid, bound in surf_bounds.items():
         bound_coords =[]
         for face in bound:
             face_coords = []
             for ring in face:
-                ring_coords =[]
-                for v in ring:
-                    ring_coords.append(tuple(v_coords[v]))
-                face_coords.append(ring_coords)
+                face_coords.append(v_coords[ring])  # gather ring coordinates by fancy indexing
             bound_coords.append(face_coords)
         surf_bounds_coords[uuid] = bound_coords
 
     return surf_bounds_coords
 
 
-# 4) Generate wkt strings of roof/ground surfaces and output a wkt file for visualization
-def write_wkt_polygon(surf_bounds_coords, output_file_nm):
+# Prefilter) Skip City Objects whose roof and ground extents are the same
+def flat_extents(flat, v_coords):
     """
-    Function that returns wkt strings of roof/groundsurfaces and outputs a wkt file for visualization
+    Function that returns the x, y extent of the surfaces of each City Object of columnar boundaries,
+    with NumPy min/max reductions over the vertex coordinates of each City Object
 
     Input:
-        surf_bounds_coords: A dictionary of roof/ground surface IDs and their boundary cooridnates
-        output_file_nm: Output wkt file name
+        flat: Columnar boundaries returned by flat_boundaries / select_surfaces
+        v_coords: An array of vertex coordinates indexed by vertex index
     Output:
-        surf_bounds_wkts: A dictionary mapping roof/ground surface IDs and their WKT strings
-                          {surface_id: '(MULTI)POLYGON((v1_x v1_y, v2_x v2_y, ...))}
-        output_wkt: A WKT file to visualize each roof/ground surfaces
+        extents: A (number of City Objects, 4) array of [min_x, min_y, max_x, max_y] (NaN if no surfaces)
     """
-    surf_bounds_wkts = {}  # {surface_id: '(MULTI)POLYGON((v1_x v1_y, v2_x v2_y, ...))}
+    # Start of each City Object in the vertex indices
+    vertex_offsets = flat['ring_offsets'][flat['face_offsets'][flat['surface_offsets'][flat['object_offsets']]]]
+    has_vertices = np.diff(vertex_offsets) > 0
 
-    with open(output_file_nm, 'w') as output_wkt:
-        output_wkt.write('uuid; geom\n')
+    extents = np.full((len(flat['object_ids']), 4), np.nan)
+    if has_vertices.any():
+        coords = v_coords[flat['vertices'], :2]
+        starts = vertex_offsets[:-1][has_vertices]  # City Objects without vertices add nothing in between
+        extents[has_vertices, :2] = np.minimum.reduceat(coords, starts)
+        extents[has_vertices, 2:] = np.maximum.reduceat(coords, starts)
 
-        for uuid, bound in surf_bounds_coords.items():
-            polygon_strs = []
-            for face in bound:
-                ring_strs = []
-                for ring in face:
-                    if ring[0] != ring[-1]:  # Close polygon
-                        ring.append(ring[0])
-                    coords_list = []
-                    for coord in ring:
-                        coords_list.append(f'{coord[0]} {coord[1]}')
-                    coords = ', '.join(coords_list)
-                    ring_strs.append(f'({coords})')
-                face_str = f"({', '.join(ring_strs)})"
-                polygon_strs.append(face_str)
-
-            if len(polygon_strs) == 1:
-                wkt = f'POLYGON{polygon_strs[0]}'
-            else:
-                all_faces = ', '.join(polygon_strs)
-                wkt = f'MULTIPOLYGON({all_faces})'
+    return extents
+
+
+def extent_prefilter(roof_flat, ground_flat, v_coords, tol):
+    """
+    Function that returns the City Objects whose roof extent differs from their ground extent by more than tol.
+    The geographicalExtent of a City Object is used as its roof extent when present, since the roof lies within it.
+    The other City Objects have a roof footprint with the same extent as their ground footprint,
+    which in most data means that they have no underpass; a passage that does not reach the outline
+    of the ground extent is missed, so this is an optional speed-up, not an exact test.
+
+    Input:
+        roof_flat: Columnar boundaries of the roof surfaces
+        ground_flat: Columnar boundaries of the ground surfaces (same City Objects as roof_flat)
+        v_coords: An array of vertex coordinates indexed by vertex index
+        tol: Maximum difference between the roof and ground extents to skip a City Object
+    Output:
+        keep: A boolean array, True for the City Objects to process further
+    """
+    roof_ext = flat_extents(roof_flat, v_coords)
+    ground_ext = flat_extents(ground_flat, v_coords)
+
+    has_roof = np.diff(roof_flat['object_offsets']) > 0
+    geo_ext = roof_flat['object_extents']
+    use_geo = has_roof & ~np.isnan(geo_ext).any(axis=1)
+    roof_ext[use_geo] = geo_ext[use_geo]
+
+    keep = np.abs(roof_ext - ground_ext).max(axis=1) > tol  # False where either extent is NaN
+
+    return keep
+
+
+# 3) Build roof/ground polygons from boundary vertex indices
+def build_polygons(surf_bounds, v_coords):
+    """
+    Function that builds (multi)polygons of roof/ground surfaces directly from their boundary vertex indices,
+    using the vectorized Shapely constructors on the whole set of rings at once
+
+    Input:
+        surf_bounds: A dictionary of roof/ground surface IDs and their boundary vertex indices
+        v_coords: An array of vertex coordinates indexed by vertex index
+    Output:
+        surf_geoms: A dictionary mapping roof/ground surface IDs and their geometries
+                    {surface_id: (MULTI)POLYGON}
+                    A surface with a single face becomes a POLYGON, otherwise a MULTIPOLYGON
+    """
+    ring_vertices = []  # vertex indices of all rings, concatenated
+    ring_sizes = []     # number of vertices per ring
+    face_sizes = []     # number of rings per face (the first ring is the exterior)
+    surf_sizes = []     # number of faces per surface
+
+    for bound in surf_bounds.values():
+        surf_sizes.append(len(bound))
+        for face in bound:
+            face_sizes.append(len(face))
+            for ring in face:
+                ring_vertices.extend(ring)
+                ring_sizes.append(len(ring))
+
+    surf_geoms = np.empty(len(surf_sizes), dtype=object)
+    if len(face_sizes) > 0:
+        coords = v_coords[np.asarray(ring_vertices, dtype=np.intp)]
+        # Rings are closed by linearrings if the first vertex is not repeated at the end
+        rings = shapely.linearrings(coords, indices=np.repeat(np.arange(len(ring_sizes)), ring_sizes))
+        faces = shapely.polygons(rings, indices=np.repeat(np.arange(len(face_sizes)), face_sizes))
 
-            output_wkt.write(f'{uuid}; {wkt}\n')
+        surf_sizes = np.asarray(surf_sizes)
+        face_surf = np.repeat(np.arange(len(surf_sizes)), surf_sizes)  # surface number of each face
+        shapely.multipolygons(faces, indices=face_surf, out=surf_geoms)
 
-            surf_bounds_wkts[uuid] = wkt
+        single = surf_sizes == 1
+        first_face = np.cumsum(surf_sizes) - surf_sizes
+        surf_geoms[single] = faces[first_face[single]]
 
-    return surf_bounds_wkts
+    return dict(zip(surf_bounds.keys(), surf_geoms))
+
+
+def flat_polygons(flat, v_coords):
+    """
+    Function that builds (multi)polygons of surfaces from their columnar boundaries with vectorized gathers
+
+    Input:
+        flat: Columnar boundaries returned by flat_boundaries / select_surfaces
+        v_coords: An array of vertex coordinates indexed by vertex index
+    Output:
+        surf_geoms: An array of surface geometries in the order of flat['surface_ids']
+                    A surface with a single face becomes a POLYGON, otherwise a MULTIPOLYGON
+    """
+    ring_sizes = np.diff(flat['ring_offsets'])
+    face_sizes = np.diff(flat['face_offsets'])
+    surf_sizes = np.diff(flat['surface_offsets'])
+
+    surf_geoms = np.empty(len(surf_sizes), dtype=object)
+    if len(face_sizes) > 0:
+        coords = v_coords[flat['vertices']]
+        # Rings are closed by linearrings if the first vertex is not repeated at the end
+        rings = shapely.linearrings(coords, indices=np.repeat(np.arange(len(ring_sizes)), ring_sizes))
+        faces = shapely.polygons(rings, indices=np.repeat(np.arange(len(face_sizes)), face_sizes))
+
+        shapely.multipolygons(faces, indices=np.repeat(np.arange(len(surf_sizes)), surf_sizes), out=surf_geoms)
+
+        single = surf_sizes == 1
+        surf_geoms[single] = faces[flat['surface_offsets'][:-1][single]]
+
+    return surf_geoms
+
+
+def flat_faces(flat, v_coords):
+    """
+    Function that builds one polygon per face of columnar boundaries (instead of one geometry per surface)
+
+    Input:
+        flat: Columnar boundaries returned by flat_boundaries / select_surfaces
+        v_coords: An array of vertex coordinates indexed by vertex index
+    Output:
+        faces: An array of face polygons in the order of the faces of flat
+        face_obj: An array of City Object numbers, one per face
+    """
+    ring_sizes = np.diff(flat['ring_offsets'])
+    face_sizes = np.diff(flat['face_offsets'])
+    face_obj = np.repeat(surface_objects(flat), np.diff(flat['surface_offsets']))
+
+    if len(face_sizes) == 0:
+        return np.empty(0, dtype=object), face_obj
+
+    rings = shapely.linearrings(v_coords[flat['vertices']], indices=np.repeat(np.arange(len(ring_sizes)), ring_sizes))
+    faces = shapely.polygons(rings, indices=np.repeat(np.arange(len(face_sizes)), face_sizes))
+
+    return faces, face_obj
+
+
+# 4) Output a wkt file of roof/ground surfaces for visualization
+def write_wkt_polygon(surf_geoms, output_file_nm):
+    """
+    Function that outputs a wkt file of roof/ground surfaces for visualization (for code verification)
+
+    Input:
+        surf_geoms: A dictionary of roof/ground surface IDs and their geometries
+        output_file_nm: Output wkt file name
+    Output:
+        output_wkt: A WKT file to visualize each roof/ground surfaces
+    """
+    wkts = shapely.to_wkt(np.asarray(list(surf_geoms.values()), dtype=object), rounding_precision=-1)
+
+    with open(output_file_nm, 'w', buffering=WRITE_BUFFER_SIZE) as output_wkt:
+        output_wkt.write('uuid; geom\n')
+        output_wkt.writelines(f'{uuid}; {wkt}\n' for uuid, wkt in zip(surf_geoms.keys(), wkts))
 
 
 # 5) Merge roof/ground surfaces and calculate area for each City Object
-def cal_area(obj_surfs, surf_bounds_wkts, output_file_nm):
+def cal_area(obj_surfs, surf_geoms, output_file_nm=None):
     """
     Function that merges roof/ground surfaces and calculates area for each City Object,
     returns dictionaries of City Object IDs and surface area and of City Object IDs and surface WKTs,
@@ -244,8 +680,9 @@ def cal_area(obj_surfs, surf_bounds_wkts, output_file_nm):
 
     Input:
         obj_surfs: A dictionary of City Objects and their roof/ground surface IDs
-        surf_bounds_wkts: A dictionary of roof/ground surface IDs and their WKT strings
+        surf_geoms: A dictionary of roof/ground surface IDs and their geometries
         output_file_nm: Output wkt file name
+                        -> default: None (no file is written)
     Output:
         obj_surf_union_wkts: A dictionary mapping City Object IDs and their merged roof/ground surface's WKT
                              {city_object_id: (MULTI)POLYGON((v1_x v1_y, v2_x v2_y, ...))}
@@ -253,80 +690,1144 @@ def cal_area(obj_surfs, surf_bounds_wkts, output_file_nm):
                        {city_object_id: area(np.float64)}
         output_wkt: A WKT file to visualize merged roof/ground surfaces for each City Objects
     """
-    obj_surf_union_wkts = {}  # {city_object_id: (MULTI)POLYGON ((v1_x v1y, v2_x v2_y, ...))}
-    obj_surf_area = {}   # {city_object_id: area(np.float64)}
+    uuids = [uuid for uuid, surfs in obj_surfs.items() if len(surfs) > 0]
 
-    with open(output_file_nm, 'w') as output_wkt:
-        output_wkt.write('uuid; geom\n')
+    geoms = []    # flat list of the surface geometries of all City Objects
+    geom_obj = [] # City Object number of each surface geometry
+    for num, uuid in enumerate(uuids):
+        for surf in obj_surfs[uuid]:
+            geoms.append(surf_geoms[surf])
+            geom_obj.append(num)
 
-        for uuid, surfs in obj_surfs.items():
-            # Case 1) A single roof/ground surface city object
-            if len(surfs) == 1:
-                poly = wkt.loads(surf_bounds_wkts[surfs[0]])
-                area = shapely.area(poly)
+    obj_union, obj_area = cal_area_batch(np.asarray(geoms, dtype=object), geom_obj, len(uuids))
 
-                obj_surf_union_wkts[uuid] = poly
-                obj_surf_area[uuid] = area
+    obj_surf_union_wkts = dict(zip(uuids, obj_union))  # {city_object_id: (MULTI)POLYGON ((v1_x v1y, v2_x v2_y, ...))}
+    obj_surf_area = dict(zip(uuids, obj_area))         # {city_object_id: area(np.float64)}
 
-                output_wkt.write(f'{uuid}; {poly}\n')
+    if output_file_nm is not None:
+        write_wkt_polygon(obj_surf_union_wkts, output_file_nm)
 
-            # Case 2) Multiple roof/ground surfaces city object
-            elif len(surfs) > 1:
-                polys = []
-                for i in range(0, len(surfs)):
-                    poly = wkt.loads(surf_bounds_wkts[surfs[i]])
-                    polys.append(poly)
+    return obj_surf_union_wkts, obj_surf_area
 
-                union_polys = shapely.unary_union(polys)  # merge surfaces
-                union_area = shapely.area(union_polys)
 
-                obj_surf_union_wkts[uuid] = union_polys
-                obj_surf_area[uuid] = union_area
+def cal_area_batch(geoms, geom_obj, n_objs, grid_size=None, coverage=False):
+    """
+    Function that merges roof/ground surfaces and calculates area for a batch of City Objects
+    with a handful of vectorized Shapely calls instead of a Python loop over the City Objects
 
-                output_wkt.write(f'{uuid}; {union_polys}\n')
+    Input:
+        geoms: A flat array of roof/ground surface geometries
+        geom_obj: An array of City Object numbers (0 ~ n_objs - 1), one per surface geometry
+        n_objs: Number of City Objects
+        grid_size: Snap the surfaces to this precision grid before merging them (see snap_grid_size).
+                   The merged surfaces keep the grid, so they and the overlays on them (e.g. diff_geometry_batch)
+                   run in fixed precision and drop slivers thinner than the grid.
+                   -> default: None (floating precision)
+        coverage: Merge the surfaces of a City Object as a coverage (see union_rows)
+                  -> default: False
+    Output:
+        obj_union: An array of merged roof/ground geometries per City Object (None if it has no surfaces)
+        obj_area: An array of roof/ground areas per City Object (NaN if it has no surfaces)
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    geom_obj = np.asarray(geom_obj, dtype=np.intp)
+    counts = np.bincount(geom_obj, minlength=n_objs)  # number of surfaces per City Object
 
-    return obj_surf_union_wkts, obj_surf_area
+    if grid_size is not None:
+        geoms = shapely.set_precision(geoms, grid_size, mode='pointwise')  # the CityJSON vertices already lie on the grid
 
+    obj_union = np.full(n_objs, None, dtype=object)
 
-# 6) Calculate the difference between roof and ground area and identify City Objects with underpasses
-def diff_area(eps, obj_roof_area, obj_ground_area, obj_roof_union_wkts, obj_ground_union_wkts, output_file_nm):
+    # Case 1) A single roof/ground surface city object: no union needed
+    single = counts[geom_obj] == 1
+    obj_union[geom_obj[single]] = geoms[single]
+
+    # Case 2) Multiple roof/ground surfaces city object: union per row of an (objects x surfaces) array.
+    # City Objects are bucketed by their surface count (powers of 2) to keep the padding small.
+    order = np.argsort(geom_obj, kind='stable')
+    order = order[~single[order]]
+    sorted_obj = geom_obj[order]
+    col = np.arange(len(order)) - np.searchsorted(sorted_obj, sorted_obj)  # position within the City Object
+    bucket = np.ceil(np.log2(counts[sorted_obj])).astype(int) if len(order) > 0 else sorted_obj
+
+    for b in np.unique(bucket):
+        in_bucket = bucket == b
+        objs, row = np.unique(sorted_obj[in_bucket], return_inverse=True)
+
+        padded = np.full((len(objs), 2 ** b), None, dtype=object)
+        padded[row, col[in_bucket]] = geoms[order[in_bucket]]
+
+        obj_union[objs] = union_rows(padded, coverage)  # merge surfaces
+        if coverage and grid_size is not None:
+            obj_union[objs] = shapely.set_precision(obj_union[objs], grid_size, mode='pointwise')  # coverage_union_all does not keep the grid of its inputs
+
+    obj_area = shapely.area(obj_union)
+
+    return obj_union, obj_area
+
+
+def snap_grid_size(transform):
     """
-    Function that calculates the difference between roof and ground area for each City Object
-    and returns City Object IDs with underpasses.
-    For testing purpose, it also returns City Object IDs that have only roof surfaces with no ground surfaces)
+    Function that returns the precision grid of the vertex coordinates of CityJSON data (the finer of the x, y transform scales)
 
     Input:
-        eps: Minimum difference between roof and ground areas to consider an underpass
-             -> default: 1e-8
-        obj_roof_area: A dictionary of City Object IDs and their roof area
-        obj_ground_area: A dictionary of City Object IDs and their ground area
-        obj_roof_union_wkts: A dictionary of City Object IDs and their merged roof surface's WKT
-        obj_ground_union_wkts: A dictionary of City Object IDs and their merged ground surface's WKT
-        output_file_nm: Output WKT file name
-                        -> format: city_obj_id; roof_wkt; ground_wkt; area_diff
+        transform: The transform of the CityJSON data {'scale': [...], 'translate': [...]}
     Output:
-        list(underpass_obj_id_diff.keys()): A list of City Object IDs with underpasses
-        only_roof_obj_ids: A list of City Object IDs that have roof surfaces but no ground surfaces (for testing)
+        grid_size: The grid size to snap to (see cal_area_batch)
     """
-    underpass_obj_id_diff = {}
-    only_roof_obj_ids = []
+    return float(min(transform['scale'][0], transform['scale'][1]))
 
-    for id, area in obj_roof_area.items():
-        roof_area = area
-        if id in obj_ground_area.keys():
-            ground_area = obj_ground_area[id]
-            diff = roof_area - ground_area  # roof - ground
 
-            if diff > eps:
-                underpass_obj_id_diff[id] = diff
-        else:
-            only_roof_obj_ids.append(id)
+def union_rows(padded, coverage=False):
+    """
+    Function that merges the geometries of each row of an (objects x surfaces) array padded with None.
+    The surfaces of a City Object usually form a coverage (faces that share edges but do not overlap),
+    which coverage_union_all merges much faster than union_all by only dissolving the shared edges.
+    Rows that are not a coverage (overlapping faces give an invalid result, unnoded edges an error)
+    are merged again with union_all.
 
-    with open(output_file_nm, 'w') as output_wkt:
-        output_wkt.write('uuid; diff; roof_geom; ground_geom\n')
+    Input:
+        padded: An (objects x surfaces) array of geometries (None for padding)
+        coverage: Merge the rows as coverages
+                  -> default: False (union_all)
+    Output:
+        row_union: An array of merged geometries, one per row
+    """
+    if not coverage:
+        return shapely.union_all(padded, axis=1)
 
-        for id, diff in underpass_obj_id_diff.items():
-            output_wkt.write(f'{id}; {diff}; {str(obj_roof_union_wkts[id])}; {str(obj_ground_union_wkts[id])}\n')
+    try:
+        row_union = shapely.coverage_union_all(padded, axis=1)
+    except shapely.errors.GEOSException:
+        return shapely.union_all(padded, axis=1)
 
-    return list(underpass_obj_id_diff.keys()), only_roof_obj_ids
+    invalid = ~shapely.is_valid(row_union)
+    if invalid.any():
+        row_union[invalid] = shapely.union_all(padded[invalid], axis=1)
+
+    return row_union
+
+
+def quantized_coords(v_coords, scale):
+    """
+    Function that returns the x, y vertex coordinates back on the integer quantization grid of CityJSON,
+    relative to the lower left vertex so that the integers stay small
+
+    Input:
+        v_coords: An array of vertex coordinates indexed by vertex index
+        scale: The transform scale of the CityJSON data [scale_x, scale_y, scale_z]
+    Output:
+        q_coords: A (number of vertices, 2) int64 array of quantized x, y coordinates
+    """
+    xy = np.asarray(v_coords)[:, :2]
+    if len(xy) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    return np.rint((xy - xy.min(axis=0)) / np.asarray(scale[:2], dtype=np.float64)).astype(np.int64)
+
+
+def shoelace_areas(flat, q_coords, scale):
+    """
+    Function that calculates the summed face area of each City Object of columnar boundaries
+    with a vectorized shoelace formula on the quantized integer coordinates of the flat rings.
+    The areas are exact (integer arithmetic, scaled once at the end), and equal the area of the merged surfaces
+    as long as the faces of a City Object do not overlap (see overlapping_objects).
+
+    Input:
+        flat: Columnar boundaries returned by flat_boundaries / select_surfaces
+        q_coords: Quantized x, y coordinates returned by quantized_coords
+        scale: The transform scale of the CityJSON data [scale_x, scale_y, scale_z]
+    Output:
+        obj_area: An array of summed face areas per City Object (NaN if it has no surfaces)
+    """
+    n_objs = len(flat['object_ids'])
+    ring_offsets = np.asarray(flat['ring_offsets'])
+    face_offsets = np.asarray(flat['face_offsets'])
+    ring_sizes = np.diff(ring_offsets)
+    n_rings = len(ring_sizes)
+
+    obj_area = np.full(n_objs, np.nan)
+    if n_rings == 0:
+        return obj_area
+
+    # Twice the signed area of every ring: sum of x_i * y_i+1 - x_i+1 * y_i, relative to the first vertex of the ring
+    ring_id = np.repeat(np.arange(n_rings), ring_sizes)
+    starts = ring_offsets[:-1]
+    coords = q_coords[flat['vertices']]
+    coords = coords - coords[starts][ring_id]
+    nxt = np.arange(1, len(coords) + 1)
+    nxt[ring_offsets[1:][ring_sizes > 0] - 1] = starts[ring_sizes > 0]  # the last vertex connects to the first one
+    cross = coords[:, 0] * coords[nxt, 1] - coords[nxt, 0] * coords[:, 1]
+    ring_2a = np.bincount(ring_id, weights=cross, minlength=n_rings)  # exact below 2 ** 53
+
+    # Face area: exterior ring minus interior rings, whatever their orientation
+    exterior = np.zeros(n_rings, dtype=bool)
+    exterior[face_offsets[:-1][np.diff(face_offsets) > 0]] = True
+    face_id = np.repeat(np.arange(len(face_offsets) - 1), np.diff(face_offsets))
+    face_2a = np.bincount(face_id, weights=np.where(exterior, 1, -1) * np.abs(ring_2a), minlength=len(face_offsets) - 1)
+
+    face_obj = np.repeat(surface_objects(flat), np.diff(flat['surface_offsets']))
+    has_surfaces = np.diff(flat['object_offsets']) > 0
+    obj_2a = np.bincount(face_obj, weights=face_2a, minlength=n_objs)
+    obj_area[has_surfaces] = obj_2a[has_surfaces] * (scale[0] * scale[1] / 2)
+
+    return obj_area
+
+
+def overlapping_objects(flat, v_coords):
+    """
+    Function that returns the City Objects of columnar boundaries with faces that overlap each other.
+    Candidate pairs of faces of the same City Object come from an STRtree query of the face bounding boxes,
+    and are then tested for intersecting interiors (intersects but not touches) in one vectorized call.
+
+    Input:
+        flat: Columnar boundaries returned by flat_boundaries / select_surfaces
+        v_coords: An array of vertex coordinates indexed by vertex index
+    Output:
+        overlap: A boolean array, True for the City Objects with overlapping faces
+    """
+    overlap = np.zeros(len(flat['object_ids']), dtype=bool)
+    faces, face_obj = flat_faces(flat, v_coords)
+    if len(faces) == 0:
+        return overlap
+
+    left, right = shapely.STRtree(faces).query(faces)
+    same = (left < right) & (face_obj[left] == face_obj[right])
+    left, right = left[same], right[same]
+
+    interiors_meet = shapely.relate_pattern(faces[left], faces[right], 'T********')
+    overlap[face_obj[left[interiors_meet]]] = True
+
+    return overlap
+
+
+def cal_area_shoelace(flat, v_coords, scale):
+    """
+    Function that calculates the roof/ground area of each City Object without merging surfaces:
+    exact shoelace areas for the City Objects whose faces do not overlap (the common case),
+    and the area of the merged surfaces (cal_area_batch) only for the others
+
+    Input:
+        flat: Columnar boundaries returned by flat_boundaries / select_surfaces
+        v_coords: An array of vertex coordinates indexed by vertex index
+        scale: The transform scale of the CityJSON data [scale_x, scale_y, scale_z]
+    Output:
+        obj_area: An array of roof/ground areas per City Object (NaN if it has no surfaces)
+        overlap: A boolean array, True for the City Objects whose area comes from merged surfaces
+    """
+    obj_area = shoelace_areas(flat, quantized_coords(v_coords, scale), scale)
+
+    overlap = overlapping_objects(flat, v_coords)
+    if overlap.any():
+        _, obj_area[overlap] = union_objects(flat, v_coords, overlap, kept_only=True)
+
+    return obj_area, overlap
+
+
+def union_objects(flat, v_coords, keep, kept_only=False):
+    """
+    Function that merges the surfaces of the given City Objects only (steps 3) and 5))
+
+    Input:
+        flat: Columnar boundaries returned by flat_boundaries / select_surfaces
+        v_coords: An array of vertex coordinates indexed by vertex index
+        keep: A boolean array, True for the City Objects to merge
+        kept_only: Return arrays over the kept City Objects only instead of all City Objects
+                -> default: False
+    Output:
+        obj_union: An array of merged geometries per City Object (None if not kept or without surfaces)
+        obj_area: An array of areas per City Object (NaN if not kept or without surfaces)
+    """
+    keep = np.asarray(keep, dtype=bool)
+    kept_flat = select_objects(flat, keep)
+    kept_union, kept_area = cal_area_batch(flat_polygons(kept_flat, v_coords), surface_objects(kept_flat), int(keep.sum()))
+    if kept_only:
+        return kept_union, kept_area
+
+    obj_union = np.full(len(keep), None, dtype=object)
+    obj_area = np.full(len(keep), np.nan)
+    obj_union[keep], obj_area[keep] = kept_union, kept_area
+
+    return obj_union, obj_area
+
+
+# 6) Calculate the difference between roof and ground area and identify City Objects with underpasses
+def diff_area(eps, obj_roof_area, obj_ground_area, obj_roof_union_wkts, obj_ground_union_wkts, output_file_nm=None):
+    """
+    Function that calculates the difference between roof and ground area for each City Object
+    and returns City Object IDs with underpasses.
+    For testing purpose, it also returns City Object IDs that have only roof surfaces with no ground surfaces)
+
+    Input:
+        eps: Minimum difference between roof and ground areas to consider an underpass
+             -> default: 1e-8
+        obj_roof_area: A dictionary of City Object IDs and their roof area
+        obj_ground_area: A dictionary of City Object IDs and their ground area
+        obj_roof_union_wkts: A dictionary of City Object IDs and their merged roof surface's WKT
+        obj_ground_union_wkts: A dictionary of City Object IDs and their merged ground surface's WKT
+        output_file_nm: Output WKT file name
+                        -> format: city_obj_id; area_diff; roof_wkt; ground_wkt
+                        -> default: None (no file is written)
+    Output:
+        list(underpass_obj_id_diff.keys()): A list of City Object IDs with underpasses
+        only_roof_obj_ids: A list of City Object IDs that have roof surfaces but no ground surfaces (for testing)
+    """
+    underpass_obj_id_diff, only_roof_obj_ids = area_diffs(eps, obj_roof_area, obj_ground_area)
+
+    if output_file_nm is not None:
+        with open(output_file_nm, 'w', buffering=WRITE_BUFFER_SIZE) as output_wkt:
+            output_wkt.write('uuid; diff; roof_geom; ground_geom\n')
+
+            for id, diff in underpass_obj_id_diff.items():
+                output_wkt.write(f'{id}; {diff}; {str(obj_roof_union_wkts[id])}; {str(obj_ground_union_wkts[id])}\n')
+
+    return list(underpass_obj_id_diff.keys()), only_roof_obj_ids
+
+
+def area_diffs(eps, obj_roof_area, obj_ground_area):
+    """
+    Function that returns the difference between roof and ground area of City Objects with underpasses
+
+    Input:
+        eps: Minimum difference between roof and ground areas to consider an underpass
+        obj_roof_area: A dictionary of City Object IDs and their roof area
+        obj_ground_area: A dictionary of City Object IDs and their ground area
+    Output:
+        underpass_obj_id_diff: A dictionary mapping City Object IDs with underpasses and their area difference
+                               {city_object_id: roof_area - ground_area}
+        only_roof_obj_ids: A list of City Object IDs that have roof surfaces but no ground surfaces (for testing)
+    """
+    underpass_obj_id_diff = {}
+    only_roof_obj_ids = []
+
+    for id, area in obj_roof_area.items():
+        roof_area = area
+        if id in obj_ground_area.keys():
+            ground_area = obj_ground_area[id]
+            diff = roof_area - ground_area  # roof - ground
+
+            if diff > eps:
+                underpass_obj_id_diff[id] = diff
+        else:
+            only_roof_obj_ids.append(id)
+
+    return underpass_obj_id_diff, only_roof_obj_ids
+
+
+def diff_area_batch(eps, roof_area, ground_area):
+    """
+    Function that calculates the difference between roof and ground area for a batch of City Objects
+
+    Input:
+        eps: Minimum difference between roof and ground areas to consider an underpass
+        roof_area: An array of roof areas per City Object (NaN if it has no roof surfaces)
+        ground_area: An array of ground areas per City Object (NaN if it has no ground surfaces)
+    Output:
+        diff: An array of roof - ground area per City Object
+        underpass: A boolean array, True for City Objects with underpasses
+        only_roof: A boolean array, True for City Objects that have roof surfaces but no ground surfaces (for testing)
+    """
+    diff = roof_area - ground_area  # roof - ground
+    underpass = diff > eps          # False where either area is NaN
+    only_roof = ~np.isnan(roof_area) & np.isnan(ground_area)
+
+    return diff, underpass, only_roof
+
+
+def diff_geometry_batch(eps, roof_union, ground_union):
+    """
+    Function that calculates the part of the merged roof that is not above the merged ground (roof - ground geometry)
+    for a batch of City Objects, instead of only comparing their areas.
+    City Objects whose roof is covered by their ground are filtered out first with a vectorized covered_by test,
+    so the expensive geometric difference only runs on the remaining candidates.
+
+    Input:
+        eps: Minimum underpass area to consider an underpass
+        roof_union: An array of merged roof geometries per City Object (None if it has no roof surfaces)
+        ground_union: An array of merged ground geometries per City Object (None if it has no ground surfaces)
+    Output:
+        underpass_geom: An array of underpass geometries (roof - ground) per City Object (None if not computed)
+        underpass_area: An array of underpass areas per City Object (0 if the roof is covered by the ground)
+        underpass_centroid: An array of underpass centroids per City Object (None if not computed)
+        underpass: A boolean array, True for City Objects with underpasses
+    """
+    n_objs = len(roof_union)
+    underpass_geom = np.full(n_objs, None, dtype=object)
+    underpass_centroid = np.full(n_objs, None, dtype=object)
+    underpass_area = np.where(shapely.is_missing(roof_union) | shapely.is_missing(ground_union), np.nan, 0.0)
+
+    candidate = np.flatnonzero(~np.isnan(underpass_area))
+    shapely.prepare(ground_union[candidate])
+    candidate = candidate[~shapely.covered_by(roof_union[candidate], ground_union[candidate])]
+
+    underpass_geom[candidate] = shapely.difference(roof_union[candidate], ground_union[candidate])
+    underpass_area[candidate] = shapely.area(underpass_geom[candidate])
+    underpass_centroid[candidate] = shapely.centroid(underpass_geom[candidate])
+
+    underpass = underpass_area > eps
+
+    return underpass_geom, underpass_area, underpass_centroid, underpass
+
+
+# 6) Alternative) Find the roof faces without ground beneath them, face by face instead of merging surfaces
+def overhang_faces(roof_flat, ground_flat, v_coords):
+    """
+    Function that marks the roof faces that have no ground face of their City Object beneath them.
+    The representative point (point_on_surface) of every roof face is queried against one STRtree of all ground faces,
+    and a roof face is supported if its point is covered by a ground face of the same City Object.
+    A roof face that is only partly above the ground counts as supported or not depending on where its point falls.
+
+    Input:
+        roof_flat, ground_flat: Columnar roof/ground boundaries with the same City Objects
+        v_coords: An array of vertex coordinates indexed by vertex index
+    Output:
+        roof_faces: An array of roof face polygons
+        face_obj: An array of City Object numbers, one per roof face
+        overhang: A boolean array, True for the roof faces without a ground face beneath them
+    """
+    roof_faces, face_obj = flat_faces(roof_flat, v_coords)
+    ground_faces, ground_obj = flat_faces(ground_flat, v_coords)
+
+    # covered_by instead of within: a point on the shared edge of two ground faces is still supported
+    point_idx, ground_idx = shapely.STRtree(ground_faces).query(shapely.point_on_surface(roof_faces), predicate='covered_by')
+    same = face_obj[point_idx] == ground_obj[ground_idx]
+
+    overhang = np.ones(len(roof_faces), dtype=bool)
+    overhang[point_idx[same]] = False
+
+    return roof_faces, face_obj, overhang
+
+
+def overhang_batch(eps, roof_flat, ground_flat, v_coords):
+    """
+    Function that identifies City Objects with underpasses from their overhanging roof faces (see overhang_faces),
+    without merging the roof and ground surfaces of every City Object.
+    Only the overhanging faces of the City Objects with underpasses are merged, for the output.
+
+    Input:
+        eps: Minimum overhang area to consider an underpass
+        roof_flat, ground_flat: Columnar roof/ground boundaries with the same City Objects
+        v_coords: An array of vertex coordinates indexed by vertex index
+    Output:
+        overhang_geom: An array of merged overhanging roof faces per City Object (None if not an underpass)
+        overhang_area: An array of summed overhanging roof face areas per City Object (NaN if it has no roof or no ground surfaces)
+        overhang_count: An array of the numbers of overhanging roof faces per City Object
+        underpass: A boolean array, True for City Objects with underpasses
+    """
+    n_objs = len(roof_flat['object_ids'])
+    roof_faces, face_obj, overhang = overhang_faces(roof_flat, ground_flat, v_coords)
+
+    overhang_count = np.bincount(face_obj[overhang], minlength=n_objs)
+    # float64 even without overhanging faces (bincount of empty weights is int64)
+    overhang_area = np.bincount(face_obj[overhang], weights=shapely.area(roof_faces[overhang]), minlength=n_objs).astype(np.float64)
+
+    has_roof = np.diff(roof_flat['object_offsets']) > 0
+    has_ground = np.diff(ground_flat['object_offsets']) > 0
+    overhang_area[~(has_roof & has_ground)] = np.nan
+
+    underpass = overhang_area > eps
+
+    output_face = overhang & underpass[face_obj]
+    overhang_geom, _ = cal_area_batch(roof_faces[output_face], face_obj[output_face], n_objs)
+
+    return overhang_geom, overhang_area, overhang_count, underpass
+
+
+# Eps sweep) Answer many eps thresholds from one computation of the area differences
+def eps_sweep(diff, eps_values):
+    """
+    Function that answers many eps thresholds at once: the area differences are sorted once
+    and every threshold is answered with a binary search (np.searchsorted) instead of a new detection
+
+    Input:
+        diff: An array of roof - ground area differences (or underpass areas) per City Object (NaN if unknown)
+        eps_values: Thresholds to answer
+    Output:
+        eps_values: The thresholds, sorted
+        n_underpasses: Number of City Objects with diff > eps for each threshold
+        n_crossed: Number of thresholds each City Object crosses,
+                   a City Object is an underpass for eps_values[:n_crossed] (0 if it crosses none)
+    """
+    eps_values = np.sort(np.asarray(eps_values, dtype=np.float64))
+    diff = np.asarray(diff, dtype=np.float64)
+
+    known = ~np.isnan(diff)
+    sorted_diff = np.sort(diff[known])
+    n_underpasses = len(sorted_diff) - np.searchsorted(sorted_diff, eps_values, side='right')
+
+    n_crossed = np.zeros(len(diff), dtype=np.int64)
+    n_crossed[known] = np.searchsorted(eps_values, diff[known], side='left')  # thresholds strictly below diff
+
+    return eps_values, n_underpasses, n_crossed
+
+
+# Output a GeoParquet file of the results
+def write_geoparquet(columns, geometry_columns, output_file_nm, crs='epsg:28992'):
+    """
+    Function that outputs a GeoParquet file (WKB geometries in a compressed columnar Parquet file) of result columns,
+    which loads much faster in QGIS / DuckDB than WKT text
+
+    Input:
+        columns: A dictionary of column names and their values {column_name: [value, ...]}
+                 The primary geometry column must be named 'geometry'
+        geometry_columns: Names of the columns holding Shapely geometries
+        output_file_nm: Output parquet file name
+        crs: Coordinate reference system of the geometries
+             -> default: 'epsg:28992' (Amersfoort / RD New)
+    Output:
+        output_parquet: A GeoParquet file
+    """
+    if gpd is None:
+        raise ImportError('geopandas (with pyarrow) is required for GeoParquet output')
+
+    columns = dict(columns)
+    for name in geometry_columns:
+        columns[name] = gpd.GeoSeries(np.asarray(columns[name], dtype=object), crs=crs)
+
+    gdf = gpd.GeoDataFrame(columns, geometry='geometry', crs=crs)
+    gdf.to_parquet(output_file_nm, compression='zstd')
+
+
+# Incremental cache) Serve unchanged City Objects from a cache of their merged roof/ground surfaces and areas
+def open_cache(cache_file):
+    """
+    Function that opens (or creates) an SQLite cache of merged roof/ground surfaces and areas per City Object.
+    Several processes can use the same cache file at the same time.
+
+    Input:
+        cache_file: SQLite cache file name
+    Output:
+        cache: An SQLite connection to the cache
+               table objects (id, hash, roof_area, ground_area, roof_union, ground_union)
+    """
+    cache = sqlite3.connect(cache_file, timeout=60)
+    cache.execute('PRAGMA journal_mode=WAL')
+    cache.execute('CREATE TABLE IF NOT EXISTS objects (id TEXT PRIMARY KEY, hash BLOB, '
+                  'roof_area REAL, ground_area REAL, roof_union BLOB, ground_union BLOB)')
+
+    return cache
+
+
+def object_hashes(flat, v_coords, grid_size=None, coverage=False):
+    """
+    Function that returns a hash of the content of each City Object of columnar boundaries:
+    the dereferenced vertex coordinates (so a change of vertex indices or transform alone does not count)
+    and the ring / face / surface structure and semantic types of its surfaces.
+    The union options are hashed as well, so a City Object merged with other options is not served from the cache.
+
+    Input:
+        flat: Columnar boundaries returned by flat_boundaries (roof and ground surfaces)
+        v_coords: An array of vertex coordinates indexed by vertex index
+        grid_size, coverage: Union options of the cached surfaces (see cal_area_batch)
+                             -> default: None, False
+    Output:
+        hashes: A list of 16-byte hashes, one per City Object [hash, ...]
+    """
+    coords = np.ascontiguousarray(v_coords[flat['vertices']])
+    ring_sizes = np.diff(flat['ring_offsets'])
+    face_sizes = np.diff(flat['face_offsets'])
+    surf_sizes = np.diff(flat['surface_offsets'])
+
+    # Offsets of each City Object in the surfaces, faces, rings and vertices
+    surf_off = flat['object_offsets']
+    face_off = flat['surface_offsets'][surf_off]
+    ring_off = flat['face_offsets'][face_off]
+    vertex_off = flat['ring_offsets'][ring_off]
+
+    hashes = []
+    for num in range(len(flat['object_ids'])):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(coords[vertex_off[num]:vertex_off[num + 1]].tobytes())
+        h.update(ring_sizes[ring_off[num]:ring_off[num + 1]].tobytes())
+        h.update(face_sizes[face_off[num]:face_off[num + 1]].tobytes())
+        h.update(surf_sizes[surf_off[num]:surf_off[num + 1]].tobytes())
+        h.update(flat['surface_types'][surf_off[num]:surf_off[num + 1]].tobytes())
+        h.update(' '.join(flat['types']).encode())
+        h.update(f'{grid_size} {coverage}'.encode())
+        hashes.append(h.digest())
+
+    return hashes
+
+
+def read_cache(cache, object_ids, hashes):
+    """
+    Function that looks up City Objects in the cache, a City Object is a hit only if its hash is unchanged
+
+    Input:
+        cache: An SQLite connection returned by open_cache
+        object_ids: City Object IDs [city_object_id, ...]
+        hashes: Hashes of the City Objects returned by object_hashes
+    Output:
+        hit: A boolean array, True for the City Objects served from the cache
+        roof_union, ground_union: Arrays of the cached merged roof/ground surfaces (None if not cached or absent)
+        roof_area, ground_area: Arrays of the cached roof/ground areas (NaN if not cached or absent)
+    """
+    n_objs = len(object_ids)
+    rows = {}  # {city_object_id: (hash, roof_area, ground_area, roof_union, ground_union)}
+    for start in range(0, n_objs, 500):  # stay below the SQLite limit of query parameters
+        ids = object_ids[start:start + 500]
+        query = f'SELECT id, hash, roof_area, ground_area, roof_union, ground_union FROM objects WHERE id IN ({",".join("?" * len(ids))})'
+        for row in cache.execute(query, ids):
+            rows[row[0]] = row[1:]
+
+    hit = np.zeros(n_objs, dtype=bool)
+    roof_area = np.full(n_objs, np.nan)
+    ground_area = np.full(n_objs, np.nan)
+    roof_wkb = np.full(n_objs, None, dtype=object)
+    ground_wkb = np.full(n_objs, None, dtype=object)
+    for num, (id, h) in enumerate(zip(object_ids, hashes)):
+        row = rows.get(id)
+        if row is None or row[0] != h:
+            continue
+
+        hit[num] = True
+        roof_area[num] = np.nan if row[1] is None else row[1]
+        ground_area[num] = np.nan if row[2] is None else row[2]
+        roof_wkb[num], ground_wkb[num] = row[3], row[4]
+
+    return hit, shapely.from_wkb(roof_wkb), shapely.from_wkb(ground_wkb), roof_area, ground_area
+
+
+def write_cache(cache, object_ids, hashes, roof_union, ground_union, roof_area, ground_area):
+    """
+    Function that stores the merged roof/ground surfaces and areas of City Objects in the cache,
+    replacing their previous entries
+
+    Input:
+        cache: An SQLite connection returned by open_cache
+        object_ids: City Object IDs [city_object_id, ...]
+        hashes: Hashes of the City Objects returned by object_hashes
+        roof_union, ground_union: Arrays of the merged roof/ground surfaces (None if absent)
+        roof_area, ground_area: Arrays of the roof/ground areas (NaN if absent)
+    """
+    roof_wkb = shapely.to_wkb(roof_union)
+    ground_wkb = shapely.to_wkb(ground_union)
+    roof_area = [None if np.isnan(area) else float(area) for area in roof_area]
+    ground_area = [None if np.isnan(area) else float(area) for area in ground_area]
+
+    with cache:
+        cache.executemany('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)',
+                          zip(object_ids, hashes, roof_area, ground_area, roof_wkb, ground_wkb))
+
+
+def cal_area_cached(roof_flat, ground_flat, v_coords, cache, hashes, grid_size=None, coverage=False):
+    """
+    Function that runs steps 3) and 5) for the new or modified City Objects only,
+    serves the other City Objects from the cache and stores the new results in it
+
+    Input:
+        roof_flat, ground_flat: Columnar roof/ground boundaries with the same City Objects
+        v_coords: An array of vertex coordinates indexed by vertex index
+        cache: An SQLite connection returned by open_cache
+        hashes: Hashes of the City Objects returned by object_hashes
+        grid_size, coverage: Union options of the new or modified City Objects (see cal_area_batch)
+                             -> default: None, False
+    Output:
+        roof_union, roof_area, ground_union, ground_area: As returned by cal_area_batch for roofs and grounds
+    """
+    obj_ids = roof_flat['object_ids']
+    hit, roof_union, ground_union, roof_area, ground_area = read_cache(cache, obj_ids, hashes)
+
+    miss = np.flatnonzero(~hit)
+    if len(miss) > 0:
+        miss_roof = select_objects(roof_flat, ~hit)
+        miss_ground = select_objects(ground_flat, ~hit)
+
+        roof_union[miss], roof_area[miss] = cal_area_batch(flat_polygons(miss_roof, v_coords), surface_objects(miss_roof), len(miss), grid_size, coverage)
+        ground_union[miss], ground_area[miss] = cal_area_batch(flat_polygons(miss_ground, v_coords), surface_objects(miss_ground), len(miss), grid_size, coverage)
+
+        write_cache(cache, [obj_ids[i] for i in miss], [hashes[i] for i in miss],
+                    roof_union[miss], ground_union[miss], roof_area[miss], ground_area[miss])
+
+    return roof_union, roof_area, ground_union, ground_area
+
+
+# Streaming input) Read a CityJSONSeq file feature by feature
+def read_cityjsonseq(input_file, aoi=None):
+    """
+    Generator that reads a CityJSONSeq (JSON Lines, https://www.cityjson.org/cityjsonseq/) file one line at a time
+    and yields each CityJSONFeature as a stand-alone CityJSON object with the transform of the header line.
+    With an area of interest, the features are filtered as they are read and features outside of it are skipped.
+
+    Input:
+        input_file: CityJSONSeq file name (*.city.jsonl)
+        aoi: The area of interest returned by area_of_interest (see select_area)
+             -> default: None (every feature)
+    Output:
+        feature_data: A CityJSON object holding the City Objects and vertices of one feature
+                      {'transform': ..., 'CityObjects': {...}, 'vertices': [...]}
+    """
+    with open(input_file) as f:
+        header = json_loads(f.readline())  # first line: CityJSON header with the transform
+
+        for line in f:
+            if not line.strip():
+                continue
+
+            feature = json_loads(line)
+            feature_data = select_area({'type': 'CityJSON',
+                                        'transform': header['transform'],
+                                        'CityObjects': feature['CityObjects'],
+                                        'vertices': feature['vertices']}, aoi)
+            if len(feature_data['CityObjects']) > 0:
+                yield feature_data
+
+
+# Steps 1) ~ 6) shared by every input mode (underpass_detection_main, detect_underpasses, UnderpassDetector)
+RESULT_COLUMNS = {'area': ('diff', 'geometry', 'ground_geom'),
+                  'geometry': ('area', 'geometry', 'centroid'),
+                  'overhang': ('area', 'geometry', 'n_faces')}  # columns of the underpass rows after the City Object ID, per method
+
+
+def split_roof_ground(flat, v_coords, prefilter_tol=None, hashes=None):
+    """
+    Function that splits columnar boundaries into roof and ground boundaries with the same City Objects,
+    skipping the City Objects whose roof and ground extents are the same (see extent_prefilter)
+
+    Input:
+        flat: Columnar boundaries returned by flat_boundaries (roof and ground surfaces)
+        v_coords: An array of vertex coordinates indexed by vertex index
+        prefilter_tol: Skip City Objects whose roof and ground extents differ by less than this
+                       -> default: None (no prefilter)
+        hashes: Hashes of the City Objects returned by object_hashes
+                -> default: None (no cache)
+    Output:
+        roof_flat, ground_flat: Columnar roof/ground boundaries of the kept City Objects
+        hashes: Hashes of the kept City Objects (None without hashes)
+    """
+    roof_flat = select_surfaces(flat, ROOF_TYPES)
+    ground_flat = select_surfaces(flat, GROUND_TYPES)
+
+    if prefilter_tol is not None:
+        keep = extent_prefilter(roof_flat, ground_flat, v_coords, prefilter_tol)
+        roof_flat = select_objects(roof_flat, keep)
+        ground_flat = select_objects(ground_flat, keep)
+        if hashes is not None:
+            hashes = [h for h, k in zip(hashes, keep) if k]
+
+    return roof_flat, ground_flat, hashes
+
+
+def merge_surfaces(roof_flat, ground_flat, v_coords, transform, method='area', cache=None, hashes=None,
+                   area_engine='union', grid_size=None, coverage=False):
+    """
+    Function that runs steps 3) ~ 5) as far as the detection method needs them
+
+    Input:
+        roof_flat, ground_flat: Columnar roof/ground boundaries with the same City Objects (see split_roof_ground)
+        v_coords: An array of vertex coordinates indexed by vertex index
+        transform: The transform of the CityJSON data (used by the shoelace area engine)
+        method: 'area', 'geometry' or 'overhang' (see find_underpasses)
+                -> default: 'area'
+        cache: An SQLite connection returned by open_cache, to recompute new or modified City Objects only
+               -> default: None (no cache)
+        hashes: Hashes of the City Objects returned by object_hashes (with cache)
+                -> default: None
+        area_engine: 'union' (area of the merged surfaces) or 'shoelace' (see cal_area_shoelace, method 'area' without a cache)
+                     -> default: 'union'
+        grid_size, coverage: Union options (see cal_area_batch)
+                             -> default: None, False
+    Output:
+        merged: (roof_union, roof_area, ground_union, ground_area) as returned by cal_area_batch, None where not computed:
+                - 'overhang': nothing is merged
+                - 'area' with the shoelace area engine: the areas only
+    """
+    if method == 'overhang':
+        return None, None, None, None
+
+    if cache is not None:
+        return cal_area_cached(roof_flat, ground_flat, v_coords, cache, hashes, grid_size, coverage)
+
+    if area_engine == 'shoelace' and method == 'area':
+        roof_area, _ = cal_area_shoelace(roof_flat, v_coords, transform['scale'])
+        ground_area, _ = cal_area_shoelace(ground_flat, v_coords, transform['scale'])
+        return None, roof_area, None, ground_area
+
+    n_objs = len(roof_flat['object_ids'])
+    roof_union, roof_area = cal_area_batch(flat_polygons(roof_flat, v_coords), surface_objects(roof_flat), n_objs, grid_size, coverage)
+    ground_union, ground_area = cal_area_batch(flat_polygons(ground_flat, v_coords), surface_objects(ground_flat), n_objs, grid_size, coverage)
+
+    return roof_union, roof_area, ground_union, ground_area
+
+
+def find_underpasses(eps, roof_flat, ground_flat, v_coords, merged, method='area'):
+    """
+    Function that identifies the City Objects with underpasses with the given method (step 6))
+
+    Input:
+        eps: Minimum difference between roof and ground areas ('area'), minimum underpass area ('geometry')
+             or minimum overhang area ('overhang')
+        roof_flat, ground_flat: Columnar roof/ground boundaries with the same City Objects
+        v_coords: An array of vertex coordinates indexed by vertex index
+        merged: The output of merge_surfaces for this method
+        method: 'area' (diff_area_batch), 'geometry' (diff_geometry_batch) or 'overhang' (overhang_batch)
+                -> default: 'area'
+    Output:
+        columns: Arrays per City Object of the RESULT_COLUMNS of the method
+        underpass: A boolean array, True for City Objects with underpasses
+        only_roof: A boolean array, True for City Objects that have roof surfaces but no ground surfaces (for testing)
+    """
+    roof_union, roof_area, ground_union, ground_area = merged
+
+    if method == 'area':
+        diff, underpass, _ = diff_area_batch(eps, roof_area, ground_area)
+        if roof_union is None:  # shoelace areas: merge the surfaces of the City Objects with underpasses only, for the output
+            roof_union, _ = union_objects(roof_flat, v_coords, underpass)
+            ground_union, _ = union_objects(ground_flat, v_coords, underpass)
+        columns = diff, roof_union, ground_union
+    elif method == 'geometry':
+        underpass_geom, underpass_area, underpass_centroid, underpass = diff_geometry_batch(eps, roof_union, ground_union)
+        columns = underpass_area, underpass_geom, underpass_centroid
+    elif method == 'overhang':
+        overhang_geom, overhang_area, overhang_count, underpass = overhang_batch(eps, roof_flat, ground_flat, v_coords)
+        columns = overhang_area, overhang_geom, overhang_count
+    else:
+        raise ValueError(f'unknown method: {method}')
+
+    only_roof = (np.diff(roof_flat['object_offsets']) > 0) & (np.diff(ground_flat['object_offsets']) == 0)
+
+    return columns, underpass, only_roof
+
+
+def underpass_rows(object_ids, columns, underpass):
+    """
+    Generator that yields (city_object_id, *columns) for each City Object with an underpass (see find_underpasses)
+    """
+    for num in np.flatnonzero(underpass):
+        yield (object_ids[num], *(col[num] for col in columns))
+
+
+# Streaming input) Run steps 1) ~ 6) on one CityJSON(Feature) object
+def detect_underpasses(input_data, eps, v_coords=None, prefilter_tol=None, cache=None, area_engine='union', snap=False, coverage=False,
+                       method='area'):
+    """
+    Generator that runs steps 1) ~ 6) on loaded CityJSON data without writing intermediate files,
+    and yields the City Objects with underpasses one by one
+
+    Input:
+        input_data: Loaded CityJSON data (a whole file or a single CityJSONSeq feature)
+        eps: Minimum difference between roof and ground areas to consider an underpass (see find_underpasses)
+        v_coords: An array of vertex coordinates indexed by vertex index
+                  -> default: None (computed from input_data by vertex_idx_to_coords)
+        prefilter_tol: Skip City Objects whose roof and ground extents differ by less than this (see extent_prefilter)
+                       -> default: None (no prefilter)
+        cache: An SQLite connection returned by open_cache, to recompute new or modified City Objects only (not used by 'overhang')
+               -> default: None (no cache)
+        area_engine: 'union' (area of the merged surfaces) or 'shoelace' (see cal_area_shoelace, not used with a cache)
+                     -> default: 'union'
+        snap: Snap the surfaces to the precision grid of the transform before merging them (see cal_area_batch)
+              -> default: False
+        coverage: Merge the surfaces of a City Object as a coverage (see union_rows)
+                  -> default: False
+        method: 'area', 'geometry' or 'overhang' (see find_underpasses)
+                -> default: 'area'
+    Output:
+        (city_object_id, *RESULT_COLUMNS[method]) for each City Object with an underpass
+    """
+    flat = flat_boundaries(input_data, ROOF_TYPES + GROUND_TYPES)
+
+    if v_coords is None:
+        v_coords = vertex_idx_to_coords(input_data)
+
+    yield from detect_flat(flat, v_coords, input_data['transform'], eps, prefilter_tol, cache, area_engine, snap, coverage, method)
+
+
+def detect_flat(flat, v_coords, transform, eps, prefilter_tol=None, cache=None, area_engine='union', snap=False, coverage=False, method='area'):
+    """
+    Generator that runs steps 3) ~ 6) on columnar boundaries (e.g. read from the tile cache by load_tile),
+    and yields the City Objects with underpasses one by one
+
+    Input:
+        flat: Columnar boundaries of roofs and grounds as returned by flat_boundaries
+        v_coords: An array of vertex coordinates indexed by vertex index
+        transform: The transform of the CityJSON data
+        eps, prefilter_tol, cache, area_engine, snap, coverage, method: See detect_underpasses
+    Output:
+        (city_object_id, *RESULT_COLUMNS[method]) for each City Object with an underpass
+    """
+    grid_size = snap_grid_size(transform) if snap else None
+    if method == 'overhang':
+        cache = None
+    hashes = object_hashes(flat, v_coords, grid_size, coverage) if cache is not None else None
+
+    roof_flat, ground_flat, hashes = split_roof_ground(flat, v_coords, prefilter_tol, hashes)
+    merged = merge_surfaces(roof_flat, ground_flat, v_coords, transform, method, cache, hashes, area_engine, grid_size, coverage)
+    columns, underpass, _ = find_underpasses(eps, roof_flat, ground_flat, v_coords, merged, method)
+
+    yield from underpass_rows(roof_flat['object_ids'], columns, underpass)
+
+
+# Batch input) Run steps 1) ~ 6) on a whole CityJSON or CityJSONSeq tile
+def detect_tile(input_file, eps, prefilter_tol=None, cache_file=None, aoi=None, area_engine='union', snap=False, coverage=False, method='area',
+                parser='auto', tile_cache=None):
+    """
+    Function that loads one CityJSON (or CityJSONSeq) tile and returns its City Objects with underpasses.
+    It is a module level function so that it can be sent to worker processes.
+
+    Input:
+        input_file: CityJSON file name, or CityJSONSeq file name (*.jsonl)
+        eps: Minimum difference between roof and ground areas to consider an underpass
+        prefilter_tol: Skip City Objects whose roof and ground extents differ by less than this (see extent_prefilter)
+                       -> default: None (no prefilter)
+        cache_file: SQLite cache file name (see open_cache), opened by the worker process itself
+                    -> default: None (no cache)
+        aoi: The area of interest returned by area_of_interest (see select_area)
+             -> default: None (every City Object)
+        area_engine: 'union' or 'shoelace' (see detect_underpasses)
+                     -> default: 'union'
+        snap, coverage: Union options (see detect_underpasses)
+                        -> default: False, False
+        method: 'area', 'geometry' or 'overhang' (see find_underpasses)
+                -> default: 'area'
+        parser: JSON parser of a CityJSON tile (see load_cityjson)
+                -> default: 'auto'
+        tile_cache: Tile cache folder of a CityJSON tile (see load_tile, CityJSONSeq tiles are not cached)
+                    -> default: None (parse the tile)
+    Output:
+        underpass_rows: A list of (city_object_id, *RESULT_COLUMNS[method]) of the tile
+    """
+    cache = open_cache(cache_file) if cache_file is not None else None
+    try:
+        if input_file.endswith('.jsonl'):
+            underpass_rows = []
+            for feature in read_cityjsonseq(input_file, aoi):
+                underpass_rows.extend(detect_underpasses(feature, eps, prefilter_tol=prefilter_tol, cache=cache, area_engine=area_engine,
+                                                         snap=snap, coverage=coverage, method=method))
+            return underpass_rows
+
+        if tile_cache is not None:
+            flat, v_coords, transform = load_tile(tile_cache, input_file, parser=parser)
+            flat = select_area_flat(flat, v_coords, aoi)
+
+            return list(detect_flat(flat, v_coords, transform, eps, prefilter_tol, cache, area_engine, snap, coverage, method))
+
+        input_data = select_area(load_cityjson(input_file, parser), aoi)
+
+        return list(detect_underpasses(input_data, eps, prefilter_tol=prefilter_tol, cache=cache, area_engine=area_engine,
+                                       snap=snap, coverage=coverage, method=method))
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+# Tile cache) Keep the parsed columnar boundaries and vertex coordinates of a tile as memory-mappable .npy files
+TILE_CACHE_VERSION = 2  # changes when the layout of the cached arrays changes
+TILE_ARRAYS = ('vertices', 'ring_offsets', 'face_offsets', 'surface_offsets', 'object_offsets',
+               'face_types', 'surface_types', 'object_extents')  # arrays of flat_boundaries kept in the tile cache
+
+
+def tile_cache_key(input_file, surface_types):
+    """
+    Function that returns the key of a tile in the tile cache: the tile is parsed again when its path, mtime or size changes
+    """
+    stat = os.stat(input_file)
+
+    return {'path': os.path.abspath(input_file), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+            'types': list(surface_types), 'version': TILE_CACHE_VERSION}
+
+
+def tile_cache_path(cache_dir, input_file):
+    """
+    Function that returns the folder of a tile in the tile cache ({cache_dir}/{file name}-{hash of the absolute path})
+    """
+    path_hash = hashlib.blake2b(os.path.abspath(input_file).encode(), digest_size=6).hexdigest()
+
+    return os.path.join(cache_dir, f'{os.path.basename(input_file)}-{path_hash}')
+
+
+def save_tile(cache_dir, input_file, flat, v_coords, transform):
+    """
+    Function that writes the columnar boundaries and vertex coordinates of a tile to the tile cache,
+    one .npy file per array and a key.json file written last, so an interrupted write is never read back
+
+    Input:
+        cache_dir: Tile cache folder
+        input_file: CityJSON file name of the tile
+        flat: Columnar boundaries returned by flat_boundaries
+        v_coords: An array of vertex coordinates indexed by vertex index
+        transform: The transform of the CityJSON data (kept for its quantization grid)
+    """
+    tile_dir = tile_cache_path(cache_dir, input_file)
+    os.makedirs(tile_dir, exist_ok=True)
+
+    key_file = os.path.join(tile_dir, 'key.json')
+    if os.path.exists(key_file):
+        os.remove(key_file)
+
+    for name in TILE_ARRAYS:
+        np.save(os.path.join(tile_dir, f'{name}.npy'), flat[name])
+    np.save(os.path.join(tile_dir, 'surface_ids.npy'), np.asarray(flat['surface_ids'], dtype=str))
+    np.save(os.path.join(tile_dir, 'object_ids.npy'), np.asarray(flat['object_ids'], dtype=str))
+    np.save(os.path.join(tile_dir, 'v_coords.npy'), v_coords)
+
+    with open(key_file, 'w') as f:
+        json.dump({**tile_cache_key(input_file, flat['types']), 'transform': transform}, f)
+
+
+def load_tile(cache_dir, input_file, surface_types=ROOF_TYPES + GROUND_TYPES, parser='auto'):
+    """
+    Function that returns the columnar boundaries and vertex coordinates of a tile from the tile cache (memory-mapped),
+    or parses the tile and writes them to the tile cache if it is not cached yet or has changed since
+
+    Input:
+        cache_dir: Tile cache folder
+        input_file: CityJSON file name of the tile
+        surface_types: Semantic surface types to collect (see flat_boundaries)
+                       -> default: roof and ground surface types
+        parser: JSON parser to use when the tile is parsed (see load_cityjson)
+                -> default: 'auto'
+    Output:
+        flat: Columnar boundaries as returned by flat_boundaries (read-only arrays)
+        v_coords: An array of vertex coordinates indexed by vertex index (read-only)
+        transform: The transform of the CityJSON data
+    """
+    tile_dir = tile_cache_path(cache_dir, input_file)
+    key_file = os.path.join(tile_dir, 'key.json')
+
+    if os.path.exists(key_file):
+        with open(key_file) as f:
+            key = json.load(f)
+
+        transform = key.pop('transform', None)
+        if key == tile_cache_key(input_file, surface_types):
+            flat = {name: np.load(os.path.join(tile_dir, f'{name}.npy'), mmap_mode='r') for name in TILE_ARRAYS}
+            flat['surface_ids'] = np.load(os.path.join(tile_dir, 'surface_ids.npy')).tolist()
+            flat['object_ids'] = np.load(os.path.join(tile_dir, 'object_ids.npy')).tolist()
+            flat['types'] = tuple(surface_types)
+
+            return flat, np.load(os.path.join(tile_dir, 'v_coords.npy'), mmap_mode='r'), transform
+
+    input_data = load_cityjson(input_file, parser)
+    flat = flat_boundaries(input_data, surface_types)
+    v_coords = vertex_idx_to_coords(input_data)
+    save_tile(cache_dir, input_file, flat, v_coords, input_data['transform'])
+
+    return flat, v_coords, input_data['transform']
+
+
+def select_area_flat(flat, v_coords, aoi):
+    """
+    Function that returns the columnar boundaries of the City Objects whose extent intersects the area of interest,
+    with the same extent as select_area (geographicalExtent, or the extent of the vertices of its surfaces)
+
+    Input:
+        flat: Columnar boundaries returned by flat_boundaries / load_tile
+        v_coords: An array of vertex coordinates indexed by vertex index
+        aoi: The area of interest returned by area_of_interest (None keeps every City Object)
+    Output:
+        flat_selected: Columnar boundaries of the City Objects in the area of interest
+    """
+    if aoi is None:
+        return flat
+
+    extents = np.array(flat['object_extents'])
+    no_extent = np.isnan(extents).any(axis=1)
+    extents[no_extent] = flat_extents(flat, v_coords)[no_extent]
+
+    keep = shapely.intersects(aoi, shapely.box(extents[:, 0], extents[:, 1], extents[:, 2], extents[:, 3]))
+    keep &= ~np.isnan(extents).any(axis=1)
+
+    return select_objects(flat, keep)
+
+
+# Shared vertex buffer) Share the vertex coordinate array with worker processes without copying
+def create_shared_vertices(v_coords, npy_file=None):
+    """
+    Function that copies the vertex coordinate array into a buffer that worker processes can attach to
+    without copying: a shared memory block, or a memory-mapped .npy file when npy_file is given
+
+    Input:
+        v_coords: An array of vertex coordinates indexed by vertex index
+        npy_file: Output .npy file name
+                  -> default: None (shared memory is used)
+    Output:
+        shm: The created shared memory block (None for a .npy file); release it with release_shared_vertices
+        handle: A small picklable description of the buffer to send to worker processes
+                {'shm_name': name, 'shape': shape, 'dtype': dtype} or {'npy_file': npy_file}
+    """
+    if npy_file is not None:
+        np.save(npy_file, v_coords)
+        return None, {'npy_file': npy_file}
+
+    shm = shared_memory.SharedMemory(create=True, size=max(v_coords.nbytes, 1))
+    np.ndarray(v_coords.shape, dtype=v_coords.dtype, buffer=shm.buf)[:] = v_coords
+
+    return shm, {'shm_name': shm.name, 'shape': v_coords.shape, 'dtype': v_coords.dtype.str}
+
+
+def attach_shared_vertices(handle):
+    """
+    Function that attaches to a vertex coordinate buffer created by create_shared_vertices
+
+    Input:
+        handle: The buffer description returned by create_shared_vertices
+    Output:
+        shm: The attached shared memory block (None for a .npy file)
+        v_coords: A read-only array view of the vertex coordinates.
+                  Delete it before calling release_shared_vertices.
+    """
+    if 'npy_file' in handle:
+        return None, np.load(handle['npy_file'], mmap_mode='r')
+
+    shm = shared_memory.SharedMemory(name=handle['shm_name'])
+    v_coords = np.ndarray(handle['shape'], dtype=handle['dtype'], buffer=shm.buf)
+    v_coords.flags.writeable = False
+
+    return shm, v_coords
+
+
+def release_shared_vertices(shm, unlink=False):
+    """
+    Function that releases a vertex coordinate buffer
+
+    Input:
+        shm: The shared memory block returned by create_shared_vertices or attach_shared_vertices
+        unlink: Whether to free the shared memory block (only by the process that created it)
+                -> default: False
+    """
+    if shm is None:
+        return
+
+    shm.close()
+    if unlink:
+        shm.unlink()
+
+
+# Shard input) Run steps 1) ~ 6) on a shard of City Objects of a loaded CityJSON file
+def detect_shard(cityobjs, v_coords_handle, eps, prefilter_tol=None, cache_file=None, transform=None, area_engine='union', snap=False, coverage=False,
+                 method='area'):
+    """
+    Function that returns the City Objects with underpasses of a shard of City Objects.
+    The vertex coordinates of the whole file are read from a shared buffer instead of being sent to every worker process.
+
+    Input:
+        cityobjs: A dictionary of the City Objects of the shard {city_object_id: city_object}
+        v_coords_handle: The shared vertex coordinate buffer description returned by create_shared_vertices
+        eps: Minimum difference between roof and ground areas to consider an underpass
+        prefilter_tol: Skip City Objects whose roof and ground extents differ by less than this (see extent_prefilter)
+                       -> default: None (no prefilter)
+        cache_file: SQLite cache file name (see open_cache), opened by the worker process itself
+                    -> default: None (no cache)
+        transform: The transform of the CityJSON file (needed by the shoelace area engine and by snap)
+                   -> default: None
+        area_engine: 'union' or 'shoelace' (see detect_underpasses)
+                     -> default: 'union'
+        snap, coverage: Union options (see detect_underpasses)
+                        -> default: False, False
+        method: 'area', 'geometry' or 'overhang' (see find_underpasses)
+                -> default: 'area'
+    Output:
+        underpass_rows: A list of (city_object_id, *RESULT_COLUMNS[method]) of the shard
+    """
+    shm, v_coords = attach_shared_vertices(v_coords_handle)
+    cache = open_cache(cache_file) if cache_file is not None else None
+    try:
+        underpass_rows = list(detect_underpasses({'CityObjects': cityobjs, 'transform': transform}, eps, v_coords, prefilter_tol, cache,
+                                                 area_engine, snap, coverage, method))
+    finally:
+        if cache is not None:
+            cache.close()
+        del v_coords  # release the view before closing the shared memory
+        release_shared_vertices(shm)
 
+    return underpass_rows
@@ -1,51 +1,577 @@
 import argparse
-import sys
+import contextlib
+import cProfile
+import glob
+import io
 import json
+import os
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import shapely
 import underpass_detection
 
+DEBUG_STAGES = ['pre_union', 'union', 'only_roof']  # stages with intermediate outputs for code verification
+PROFILE_STAGES = ['load', 'extract', 'coords', 'hash', 'prefilter', 'wkt', 'union', 'diff', 'output', 'detect', 'total']  # stages of the run report
+
+
 def main():
     parser = argparse.ArgumentParser(description="Detect buildings with underpasses")
 
-    parser.add_argument("inputfile", help="Input cityjson file (required)")
-    parser.add_argument("--eps", type=float, default=1e-8, help="Minimum difference between roof and ground areas to consider an underpass")
+    parser.add_argument("inputfile", help="Input cityjson file, or cityjsonseq file (*.jsonl) to process it feature by feature, "
+                                          "or a directory / glob pattern of tiles to process them in parallel (required)")
+    parser.add_argument("--eps", nargs='+', default=['1e-8'], help="Minimum difference between roof and ground areas to consider an underpass. "
+                                                                  "Several values or START:STOP:STEP ranges run an eps sweep in one run")
+    parser.add_argument("--prefilter-tol", type=float, default=None, help="Skip City Objects whose roof and ground extents differ by less than this (off by default)")
+    parser.add_argument("--bbox", type=float, nargs=4, default=None, metavar=('MIN_X', 'MIN_Y', 'MAX_X', 'MAX_Y'),
+                        help="Only process City Objects whose extent intersects this bounding box")
+    parser.add_argument("--clip-polygon", default=None, help="Only process City Objects whose extent intersects this polygon (WKT, or a file containing WKT)")
+    parser.add_argument("--method", choices=['area', 'geometry', 'overhang'], default='area',
+                        help="area: compare roof and ground areas / geometry: compute the roof - ground geometry / "
+                             "overhang: find the roof faces without a ground face beneath them (a face counts as a whole: it misses a passage "
+                             "under part of a face whose point is above the ground, and counts a whole face whose point is above the passage)")
+    parser.add_argument("--area-engine", choices=['union', 'shoelace'], default='union',
+                        help="union: area of the merged surfaces / shoelace: exact shoelace areas on the quantized coordinates, "
+                             "merging surfaces only for City Objects with overlapping faces and for the output (area method)")
+    parser.add_argument("--snap-grid", action='store_true', help="Snap the roof/ground surfaces to the precision grid of the cityjson transform before merging them")
+    parser.add_argument("--union", choices=['unary', 'coverage'], default='unary',
+                        help="unary: merge surfaces with union_all / coverage: with coverage_union_all, "
+                             "falling back to union_all for City Objects whose surfaces are not a coverage")
+    parser.add_argument("--output-format", choices=['wkt', 'parquet'], default='wkt', help="Format of the underpass output file (parquet: GeoParquet)")
+
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes for a directory / glob of tiles or for shards")
+    parser.add_argument("--shards", type=int, default=1, help="Split the City Objects of the input cityjson file into this many shards processed in parallel")
+    parser.add_argument("--parser", choices=['auto', 'simdjson', 'orjson', 'json'], default='auto', help="JSON parser for cityjson input (auto: fastest installed one)")
+    parser.add_argument("--cache", default=None, help="SQLite cache of merged roof/ground surfaces and areas per City Object, "
+                                                      "so only new or modified City Objects are recomputed (off by default)")
+    parser.add_argument("--tile-cache", default=None, help="Folder of memory-mappable binary copies of parsed cityjson files, "
+                                                           "so later runs on an unchanged file skip parsing and extraction "
+                                                           "(cityjson files and tiles only, off by default)")
+    parser.add_argument("--debug", action='append', choices=DEBUG_STAGES + ['all'], default=[],
+                        help="Write the intermediate outputs of a stage for code verification (repeatable, off by default): "
+                             "pre_union: roof/ground_pre_union.wkt / union: roof/ground_union.wkt / only_roof: print City Objects with only roof surfaces")
+    parser.add_argument("--profile", nargs='?', const='run_report.json', default=None,
+                        help="Write a JSON run report with the wall time, CPU time, peak RSS and counts of every stage (default file: run_report.json)")
+    parser.add_argument("--profile-stage", choices=PROFILE_STAGES, default=None, help="Also profile this stage of the run report with --profile-tool")
+    parser.add_argument("--profile-tool", choices=['cprofile', 'tracemalloc'], default='cprofile',
+                        help="cprofile: write profile_{stage}.prof and the top functions to the report / tracemalloc: the peak traced memory and top allocations")
 
     args = parser.parse_args()
 
+    if args.method == 'overhang' and args.cache is not None:
+        parser.error('--cache is not used by --method overhang (it merges no surfaces)')
+    if 'union' in args.debug and (args.method == 'overhang' or (args.method == 'area' and args.area_engine == 'shoelace' and args.cache is None)):
+        parser.error('--debug union needs the merged surfaces, which --method overhang and --area-engine shoelace do not compute')
+    if args.tile_cache is not None and args.inputfile.endswith('.jsonl'):
+        parser.error('--tile-cache is not used for cityjsonseq input (its features are streamed, not parsed as a whole)')
+    if args.profile_stage is not None:
+        if args.profile is None:
+            parser.error('--profile-stage needs --profile')
+        if args.profile_stage not in run_stages(args):
+            parser.error(f'--profile-stage {args.profile_stage} does not run for this input and options '
+                         f'(stages: {", ".join(run_stages(args))})')
+    try:
+        args.eps_values = parse_eps(args.eps)
+    except ValueError as e:
+        parser.error(f'argument --eps: {e}')
+    args.eps = args.eps_values[0]  # the detection runs with the smallest threshold, the others are answered from its differences
+    try:
+        clip_polygon = read_clip_polygon(args.clip_polygon)
+    except shapely.errors.GEOSException as e:
+        parser.error(f'argument --clip-polygon: {e}')
+    args.aoi = underpass_detection.area_of_interest(args.bbox, clip_polygon)
+    args.report = new_report(args) if args.profile is not None else None
+
+    try:
+        with profile_stage(args.report, 'total'):
+            if os.path.isdir(args.inputfile) or glob.has_magic(args.inputfile):
+                main_batch(args)
+            elif args.inputfile.endswith('.jsonl'):
+                main_seq(args)
+            else:
+                main_file(args)
+    finally:
+        if args.report is not None:
+            write_report(args.report, args.profile)
+
+
+def main_file(args):
+    """
+    Runs steps 1) ~ 6) on a single cityjson file (with --profile, every step is a stage of the run report)
+    """
+    report = args.report
+
+    if args.tile_cache is not None and args.shards == 1:
+        # 0) ~ 2) Read the columnar boundaries and vertex coordinates from the tile cache (parsed and cached on the first run)
+        with profile_stage(report, 'load') as counts:
+            try:
+                flat, v_coords, transform = underpass_detection.load_tile(args.tile_cache, args.inputfile, parser=args.parser)
+            except Exception as e:
+                print(e)
+                sys.exit()
+
+            # Keep only the City Objects in the area of interest
+            flat = underpass_detection.select_area_flat(flat, v_coords, args.aoi)
+            counts.update(flat_counts(flat), vertices=len(v_coords))
+    else:
+        with profile_stage(report, 'load') as counts:
+            try:
+                data = underpass_detection.load_cityjson(args.inputfile, args.parser)
+            except Exception as e:
+                print(e)
+                sys.exit()
+
+            # Keep only the City Objects in the area of interest
+            data = underpass_detection.select_area(data, args.aoi)
+            transform = data['transform']
+            counts.update(objects=len(data['CityObjects']), vertices=len(data['vertices']))
+
+        if args.shards > 1:
+            main_shards(args, data)
+            return
+
+        # 1) Create columnar boundaries of roofs and grounds per city object
+        with profile_stage(report, 'extract') as counts:
+            flat = underpass_detection.flat_boundaries(data, underpass_detection.ROOF_TYPES + underpass_detection.GROUND_TYPES)
+            counts.update(flat_counts(flat))
+
+        # 2) Translate vertex coordinates from indices
+        with profile_stage(report, 'coords') as counts:
+            v_coords = underpass_detection.vertex_idx_to_coords(data)
+            counts.update(vertices=len(v_coords))
+
+    grid_size = underpass_detection.snap_grid_size(transform) if args.snap_grid else None
+    coverage = args.union == 'coverage'
+
+    hashes = None
+    if args.cache is not None:
+        with profile_stage(report, 'hash') as counts:
+            hashes = underpass_detection.object_hashes(flat, v_coords, grid_size, coverage)
+            counts.update(objects=len(hashes))
+
+    # Split roof and ground surfaces, skipping City Objects whose roof and ground extents are the same
+    with profile_stage(report if args.prefilter_tol is not None else None, 'prefilter') as counts:
+        roof_flat, ground_flat, hashes = underpass_detection.split_roof_ground(flat, v_coords, args.prefilter_tol, hashes)
+        counts.update(objects=len(roof_flat['object_ids']))
+
+    obj_ids = roof_flat['object_ids']
+
+    # 3) ~ 4) Output wkt files of roof/ground surfaces for visualization (for code verification)
+    if debug_stage(args, 'pre_union'):
+        with profile_stage(report, 'wkt') as counts:
+            roof_geoms = underpass_detection.flat_polygons(roof_flat, v_coords)
+            ground_geoms = underpass_detection.flat_polygons(ground_flat, v_coords)
+            underpass_detection.write_wkt_polygon(dict(zip(ground_flat['surface_ids'], ground_geoms)), 'ground_pre_union.wkt')
+            underpass_detection.write_wkt_polygon(dict(zip(roof_flat['surface_ids'], roof_geoms)), 'roof_pre_union.wkt')
+            counts.update(surfaces=len(roof_geoms) + len(ground_geoms))
+
+    # 3) ~ 5) Build roof/ground polygons, merge them and calculate area for each City Object (as far as the method needs them)
+    with profile_stage(report, 'union') as counts:
+        cache = underpass_detection.open_cache(args.cache) if args.cache is not None else None
+        try:
+            merged = underpass_detection.merge_surfaces(roof_flat, ground_flat, v_coords, transform, args.method, cache, hashes,
+                                                        args.area_engine, grid_size, coverage)
+        finally:
+            if cache is not None:
+                cache.close()
+        counts.update(objects=len(obj_ids))
+
+    roof_union, _, ground_union, _ = merged
+    if debug_stage(args, 'union') and roof_union is not None:
+        has_roof = np.diff(roof_flat['object_offsets']) > 0
+        has_ground = np.diff(ground_flat['object_offsets']) > 0
+        underpass_detection.write_wkt_polygon({obj_ids[i]: roof_union[i] for i in np.flatnonzero(has_roof)}, 'roof_union.wkt')
+        underpass_detection.write_wkt_polygon({obj_ids[i]: ground_union[i] for i in np.flatnonzero(has_ground)}, 'ground_union.wkt')
+
+    # 6) Identify City Objects with underpasses with the chosen method
+    with profile_stage(report, 'diff') as counts:
+        columns, underpass, only_roof = underpass_detection.find_underpasses(args.eps, roof_flat, ground_flat, v_coords, merged, args.method)
+        counts.update(objects=len(obj_ids), underpasses=int(underpass.sum()))
+
+    with profile_stage(report, 'output') as counts:
+        counts.update(underpasses=output_results(args, underpass_detection.underpass_rows(obj_ids, columns, underpass)))
+
+    if debug_stage(args, 'only_roof'):
+        print(f'\nonly_roof_obj_ids\n{[obj_ids[i] for i in np.flatnonzero(only_roof)]}')
+
+
+def read_clip_polygon(clip_polygon):
+    """
+    Returns the clip polygon given as WKT text or as a file containing WKT (None if not given)
+    """
+    if clip_polygon is None:
+        return None
+
+    if os.path.isfile(clip_polygon):
+        with open(clip_polygon) as f:
+            clip_polygon = f.read()
+
+    return shapely.from_wkt(clip_polygon.strip())
+
+
+def run_stages(args):
+    """
+    Returns the stages of the run report (PROFILE_STAGES) that run for the input and options of args
+    """
+    if os.path.isdir(args.inputfile) or glob.has_magic(args.inputfile) or args.inputfile.endswith('.jsonl'):
+        return ['detect', 'total']  # steps 1) ~ 6) and the output run per tile or feature
+    if args.shards > 1:
+        return ['load', 'detect', 'total']
+
+    stages = ['load']
+    if args.tile_cache is None:
+        stages += ['extract', 'coords']
+    if args.cache is not None:
+        stages.append('hash')
+    if args.prefilter_tol is not None:
+        stages.append('prefilter')
+    if debug_stage(args, 'pre_union'):
+        stages.append('wkt')
+
+    return stages + ['union', 'diff', 'output', 'total']
+
+
+def debug_stage(args, stage):
+    """
+    Returns whether the intermediate outputs of a stage were requested with --debug
+    """
+    return stage in args.debug or 'all' in args.debug
+
+
+def new_report(args):
+    """
+    Returns an empty run report of the given arguments (see profile_stage)
+    """
+    return {'input': args.inputfile, 'eps': args.eps_values, 'method': args.method,
+            'profile_stage': args.profile_stage, 'profile_tool': args.profile_tool,
+            'stages': {}}
+
+
+@contextlib.contextmanager
+def profile_stage(report, stage):
+    """
+    Context manager that records the wall time, CPU time and RSS (start, end and peak) of a stage in the run report,
+    with the counts the stage puts in the yielded dictionary, and profiles the stage chosen with --profile-stage
+
+    Input:
+        report: A run report returned by new_report (None to record nothing)
+        stage: Stage name (one of PROFILE_STAGES)
+    Output:
+        counts: A dictionary for the counts of the stage {'objects': ..., 'surfaces': ..., 'vertices': ...}
+    """
+    counts = {}
+    if report is None:
+        yield counts
+        return
+
+    profiler = None
+    if stage == report['profile_stage']:
+        if report['profile_tool'] == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            tracemalloc.start()
+
+    # 'total' encloses the other stages, which reset the peak RSS, so its peak is taken from theirs and from getrusage
+    peak_reset = stage != 'total' and reset_peak_rss()
+    rss_start = memory_status()
+
+    wall, cpu = time.perf_counter(), time.process_time()
     try:
-        with open(args.inputfile) as f:
-            data = json.load(f)
-    except Exception as e:
-        print(e)
+        yield counts
+    finally:
+        result = {'wall_seconds': time.perf_counter() - wall,
+                  'cpu_seconds': time.process_time() - cpu}
+
+        rss_end = memory_status()
+        if rss_start is not None and rss_end is not None:
+            result['start_rss_mib'], result['end_rss_mib'] = rss_start[0], rss_end[0]
+            if peak_reset:
+                result['peak_rss_mib'] = rss_end[1]  # peak since the start of the stage
+        if stage == 'total':
+            stage_peaks = [r['peak_rss_mib'] for r in report['stages'].values() if 'peak_rss_mib' in r]
+            result['peak_rss_mib'] = max([resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10] + stage_peaks)
+            result['children_peak_rss_mib'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 2 ** 10  # worker processes
+
+        if stage == report['profile_stage']:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(f'profile_{stage}.prof')
+                top = io.StringIO()
+                pstats.Stats(profiler, stream=top).sort_stats('cumulative').print_stats(20)
+                result['cprofile'] = {'file': f'profile_{stage}.prof', 'top': top.getvalue().splitlines()}
+            else:
+                snapshot = tracemalloc.take_snapshot()
+                result['tracemalloc'] = {'peak_mib': tracemalloc.get_traced_memory()[1] / 2 ** 20,
+                                         'top': [str(stat) for stat in snapshot.statistics('lineno')[:20]]}
+                tracemalloc.stop()
+
+        report['stages'][stage] = {**result, **counts}
+
+
+def memory_status():
+    """
+    Returns the current and peak RSS (MiB) of this process from /proc/self/status, or None where it is not available (not Linux)
+    """
+    try:
+        with open('/proc/self/status') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None
+
+    return int(status['VmRSS'].split()[0]) / 2 ** 10, int(status['VmHWM'].split()[0]) / 2 ** 10
+
+
+def reset_peak_rss():
+    """
+    Resets the peak RSS (VmHWM) of this process through /proc/self/clear_refs, so that the next reading is the peak of one stage.
+    Returns whether it was reset (Linux only)
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+
+    return True
+
+
+def flat_counts(flat):
+    """
+    Returns the numbers of City Objects, surfaces, faces and vertex indices of columnar boundaries
+    """
+    return {'objects': len(flat['object_ids']), 'surfaces': len(flat['surface_ids']),
+            'faces': len(flat['face_offsets']) - 1, 'vertex_indices': len(flat['vertices'])}
+
+
+def write_report(report, report_file):
+    """
+    Writes the run report to a JSON file
+    """
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f'run report written to {report_file}')
+
+
+def main_seq(args):
+    """
+    Streaming mode for CityJSONSeq input: every feature goes through steps 1) ~ 6) on its own,
+    so the peak memory is bounded by the largest feature instead of the whole file.
+    The intermediate outputs for code verification (--debug) are not written in this mode.
+    """
+    eps = args.eps
+
+    cache = underpass_detection.open_cache(args.cache) if args.cache is not None else None
+    try:
+        underpass_rows = (row for feature in underpass_detection.read_cityjsonseq(args.inputfile, args.aoi)
+                          for row in underpass_detection.detect_underpasses(feature, eps, prefilter_tol=args.prefilter_tol, cache=cache, area_engine=args.area_engine,
+                                                                            snap=args.snap_grid, coverage=args.union == 'coverage', method=args.method))
+        with profile_stage(args.report, 'detect') as counts:
+            counts.update(underpasses=output_results(args, underpass_rows))
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def main_batch(args):
+    """
+    Batch mode for a directory or glob pattern of tiles: every tile goes through steps 1) ~ 6)
+    in its own worker process, and the City Objects with underpasses of all tiles are merged
+    into a single output in the order of the tiles.
+    The intermediate outputs for code verification (--debug) are not written in this mode.
+    """
+    if os.path.isdir(args.inputfile):
+        input_files = sorted(glob.glob(os.path.join(args.inputfile, '*.json')) + glob.glob(os.path.join(args.inputfile, '*.jsonl')))
+    else:
+        input_files = sorted(glob.glob(args.inputfile))
+
+    if len(input_files) == 0:
+        print(f'no input files found: {args.inputfile}')
         sys.exit()
 
-    # 1) Create lists of roofs and grounds per city object
-    obj_roofs, roof_bounds = underpass_detection.roof_boundaries(data)
-    obj_grounds, ground_bounds = underpass_detection.ground_boundaries(data)
+    eps = args.eps
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        n = len(input_files)
+        tile_rows = executor.map(underpass_detection.detect_tile, input_files, [eps] * n, [args.prefilter_tol] * n, [args.cache] * n, [args.aoi] * n, [args.area_engine] * n,
+                                 [args.snap_grid] * n, [args.union == 'coverage'] * n, [args.method] * n, [args.parser] * n,
+                                 [args.tile_cache] * n)
+        with profile_stage(args.report, 'detect') as counts:
+            counts.update(tiles=n, underpasses=output_results(args, (row for underpass_rows in tile_rows for row in underpass_rows)))
+
 
-    # 2) Translate vertex coordinates from indices
+def main_shards(args, data):
+    """
+    Shard mode for a single large cityjson file: the City Objects are split into shards that go through
+    steps 1) ~ 6) in worker processes. The vertex coordinates are computed once and shared with the workers
+    through shared memory, and the results are gathered back in the original City Object order.
+    The intermediate outputs for code verification (--debug) are not written in this mode.
+    """
+    eps = args.eps
+
+    # 2) Translate vertex coordinates from indices, once for all shards
     v_coords = underpass_detection.vertex_idx_to_coords(data)
 
-    # 3) Get boundary coordinates
-    roof_coords = underpass_detection.boundary_idx_to_coords(roof_bounds, v_coords)
-    ground_coords = underpass_detection.boundary_idx_to_coords(ground_bounds, v_coords)
+    shm, v_coords_handle = underpass_detection.create_shared_vertices(v_coords)
+    del v_coords
+    try:
+        cityobj_ids = list(data['CityObjects'].keys())
+        shards = []  # [{city_object_id: city_object}, ...] in the original order
+        for shard_ids in np.array_split(np.arange(len(cityobj_ids)), args.shards):
+            shards.append({cityobj_ids[i]: data['CityObjects'][cityobj_ids[i]] for i in shard_ids})
 
-    # 4) Generate wkt strings of roof/ground surfaces and output a wkt file for visualization
-    ground_wkts = underpass_detection.write_wkt_polygon(ground_coords, 'ground_pre_union.wkt')
-    roof_wkts = underpass_detection.write_wkt_polygon(roof_coords, 'roof_pre_union.wkt')
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            n = len(shards)
+            shard_rows = executor.map(underpass_detection.detect_shard, shards, [v_coords_handle] * n, [eps] * n, [args.prefilter_tol] * n, [args.cache] * n,
+                                      [data['transform']] * n, [args.area_engine] * n, [args.snap_grid] * n, [args.union == 'coverage'] * n,
+                                      [args.method] * n)
+            with profile_stage(args.report, 'detect') as counts:
+                counts.update(shards=n, underpasses=output_results(args, (row for underpass_rows in shard_rows for row in underpass_rows)))
+    finally:
+        underpass_detection.release_shared_vertices(shm, unlink=True)
 
-    # 5) Merge roof/ground surfaces and calculate area for each City Object
-    obj_roof_union_wkts, obj_roof_area = underpass_detection.cal_area(obj_roofs, roof_wkts, 'roof_union.wkt')
-    obj_ground_union_wkts, obj_ground_area = underpass_detection.cal_area(obj_grounds, ground_wkts, 'ground_union.wkt')
 
-    # 6) Calculate the difference between roof and ground area and identify City Objects with underpasses
-    eps = args.eps
-    underpass_obj_ids, only_roof_obj_ids = underpass_detection.diff_area(eps, obj_roof_area, obj_ground_area, obj_roof_union_wkts, obj_ground_union_wkts, f'underpass_obj_eps_{eps}.wkt')
+def parse_eps(eps_args):
+    """
+    Returns the sorted eps thresholds of --eps values, each a number or a START:STOP:STEP range (STOP included)
+    (raises ValueError for a value that is not a number, a range step that is not positive, or no threshold at all)
+    """
+    eps_values = []
+    for value in eps_args:
+        for part in value.split(','):
+            if ':' in part:
+                if part.count(':') != 2:
+                    raise ValueError(f'{part} is not a START:STOP:STEP range')
+                start, stop, step = (float(v) for v in part.split(':'))
+                if step <= 0:
+                    raise ValueError(f'the step of the range {part} must be positive')
+                eps_values.extend(np.arange(start, stop + step / 2, step).tolist())
+            elif part:
+                eps_values.append(float(part))
+
+    if not eps_values:
+        raise ValueError(f'no threshold in {" ".join(eps_args)}')
+
+    return sorted(set(eps_values))
+
+
+def output_results(args, underpass_rows):
+    """
+    Writes the City Objects with underpasses of one threshold (output_underpasses), or the eps sweep table (output_sweep)
+
+    Output:
+        n_underpasses: Number of City Objects with underpasses for the smallest threshold
+    """
+    if len(args.eps_values) > 1:
+        return output_sweep(underpass_rows, args.eps_values, args.output_format, underpass_detection.RESULT_COLUMNS[args.method][0])
+
+    return output_underpasses(underpass_rows, args.eps, args.output_format, args.method)
+
+
+def output_sweep(underpass_rows, eps_values, output_format, value_name='diff'):
+    """
+    Prints the number of City Objects with underpasses for every threshold and writes a compact table of
+    which City Objects cross which thresholds to underpass_obj_eps_sweep.txt (semicolon-separated),
+    or to underpass_obj_eps_sweep.parquet (GeoParquet, with the geometries)
+
+    Input:
+        underpass_rows: An iterable of (city_object_id, value, geometry, ...) of the City Objects with underpasses
+                        for the smallest threshold (see underpass_detection.RESULT_COLUMNS),
+                        value is the area difference (or the underpass / overhang area)
+        eps_values: The sorted thresholds
+        output_format: 'wkt' or 'parquet'
+        value_name: Name of the value column ('diff' or 'area', the first of the RESULT_COLUMNS of the method)
+    Output:
+        n_underpasses: Number of City Objects with underpasses for the smallest threshold
+    """
+    ids, values, geoms = [], [], []
+    for row in underpass_rows:
+        ids.append(row[0])
+        values.append(row[1])
+        geoms.append(row[2])
+
+    eps_values, n_underpasses, n_crossed = underpass_detection.eps_sweep(values, eps_values)
+    max_eps = eps_values[np.maximum(n_crossed, 1) - 1]  # largest threshold crossed by each City Object
+
+    order = np.argsort(-np.asarray(values, dtype=np.float64), kind='stable')
 
+    print('<Number of City Objects with Underpass per eps>')
+    for eps, n in zip(eps_values, n_underpasses):
+        print(f'{eps}; {n}')
+
+    if output_format == 'parquet':
+        underpass_detection.write_geoparquet({'uuid': [ids[i] for i in order],
+                                              value_name: np.asarray(values, dtype=np.float64)[order],
+                                              'max_eps': max_eps[order],
+                                              'n_eps': n_crossed[order],
+                                              'geometry': np.asarray(geoms, dtype=object)[order]},
+                                             ['geometry'], 'underpass_obj_eps_sweep.parquet')
+    else:
+        with open('underpass_obj_eps_sweep.txt', 'w', buffering=underpass_detection.WRITE_BUFFER_SIZE) as output_txt:
+            output_txt.write(f'# eps: {", ".join(str(eps) for eps in eps_values)}\n')
+            output_txt.write(f'uuid; {value_name}; max_eps; n_eps\n')
+            output_txt.writelines(f'{ids[i]}; {values[i]}; {max_eps[i]}; {n_crossed[i]}\n' for i in order)
+
+    return len(ids)
+
+
+UNDERPASS_OUTPUTS = {'area': ('underpass_obj', 'uuid; diff; roof_geom; ground_geom', (0, 1, 2, 3)),
+                     'geometry': ('underpass_geom', 'uuid; area; centroid; underpass_geom', (0, 1, 3, 2)),
+                     'overhang': ('underpass_overhang', 'uuid; area; n_faces; overhang_geom', (0, 1, 3, 2))}  # file name, wkt header, row columns per method
+
+
+def output_underpasses(underpass_rows, eps, output_format, method='area'):
+    """
+    Prints the IDs of the City Objects with underpasses and writes them to {name}_eps_{eps}.wkt
+    as they come, or to {name}_eps_{eps}.parquet (GeoParquet) once all of them are known (see UNDERPASS_OUTPUTS)
+
+    Input:
+        underpass_rows: An iterable of (city_object_id, *underpass_detection.RESULT_COLUMNS[method])
+        eps: The threshold of the detection
+        output_format: 'wkt' or 'parquet'
+        method: 'area', 'geometry' or 'overhang'
+                -> default: 'area'
+    Output:
+        n_underpasses: Number of City Objects with underpasses
+    """
+    name, header, wkt_columns = UNDERPASS_OUTPUTS[method]
     print('<City Object IDs with Underpass>')
-    for obj in underpass_obj_ids:
-        print(obj)
 
-    # print(f'\nonly_roof_obj_ids\n{only_roof_obj_ids}')
+    if output_format == 'parquet':
+        rows = []
+        for row in underpass_rows:
+            rows.append(row)
+            print(row[0])
+
+        ids, values, geoms, extras = (list(col) for col in zip(*rows)) if rows else ([], [], [], [])
+        values = np.asarray(values, dtype=np.float64)
+        if method == 'area':
+            columns = {'uuid': ids, 'roof_area': shapely.area(geoms), 'ground_area': shapely.area(extras), 'diff': values,
+                       'geometry': geoms, 'ground_geom': extras}
+        elif method == 'geometry':
+            columns = {'uuid': ids, 'area': values, 'centroid': extras, 'geometry': geoms}
+        else:
+            columns = {'uuid': ids, 'area': values, 'n_faces': np.asarray(extras, dtype=np.int64), 'geometry': geoms}
+        underpass_detection.write_geoparquet(columns, [col for col in ('geometry', 'ground_geom', 'centroid') if col in columns],
+                                             f'{name}_eps_{eps}.parquet')
+        return len(ids)
+
+    with open(f'{name}_eps_{eps}.wkt', 'w', buffering=underpass_detection.WRITE_BUFFER_SIZE) as output_wkt:
+        output_wkt.write(header + '\n')
+
+        n_underpasses = 0
+        for row in underpass_rows:
+            output_wkt.write('; '.join(str(row[i]) for i in wkt_columns) + '\n')
+            print(row[0])
+            n_underpasses += 1
+
+    return n_underpasses
+
 
 if __name__ == "__main__":
     main()
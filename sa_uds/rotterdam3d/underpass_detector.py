@@ -0,0 +1,153 @@
+import numpy as np
+import underpass_detection
+
+
+class UnderpassDetector:
+    """
+    Pipeline object that parses CityJSON data once, keeps its vertex table and extracted surfaces,
+    and answers detections as in-memory result tables {column_name: [value, ...]} instead of printing and writing files.
+    The merged roof/ground surfaces are computed on the first detection and reused by the following ones,
+    so several eps values or methods can be tried on one parsed dataset.
+
+    Usage:
+        detector = UnderpassDetector.from_file('test_export.json')
+        underpasses = detector.detect(eps=20)
+        underpass_geoms = detector.detect(eps=20, method='geometry')
+        overhangs = detector.detect(eps=20, method='overhang')
+        ocs = detector.outer_ceiling_surfaces()
+    """
+
+    def __init__(self, input_data, prefilter_tol=None, cache_file=None, snap=False, coverage=False):
+        """
+        Input:
+            input_data: Loaded CityJSON data (see underpass_detection.load_cityjson)
+            prefilter_tol: Skip City Objects whose roof and ground extents differ by less than this (see extent_prefilter)
+                           -> default: None (no prefilter)
+            cache_file: SQLite cache file name (see open_cache), to recompute new or modified City Objects only
+                        -> default: None (no cache)
+            snap: Snap the surfaces to the precision grid of the transform before merging them (see cal_area_batch)
+                  -> default: False
+            coverage: Merge the surfaces of a City Object as a coverage (see union_rows)
+                      -> default: False
+        """
+        self.input_data = input_data
+        self.prefilter_tol = prefilter_tol
+        self.cache_file = cache_file
+        self.grid_size = underpass_detection.snap_grid_size(input_data['transform']) if snap else None
+        self.coverage = coverage
+
+        # 1) Create columnar boundaries of roofs and grounds per city object
+        flat = underpass_detection.flat_boundaries(input_data, underpass_detection.ROOF_TYPES + underpass_detection.GROUND_TYPES)
+
+        # 2) Translate vertex coordinates from indices
+        self.v_coords = underpass_detection.vertex_idx_to_coords(input_data)
+
+        hashes = underpass_detection.object_hashes(flat, self.v_coords, self.grid_size, self.coverage) if cache_file is not None else None
+
+        # Split roof and ground surfaces, skipping City Objects whose roof and ground extents are the same
+        self.roof_flat, self.ground_flat, self.hashes = underpass_detection.split_roof_ground(flat, self.v_coords, prefilter_tol, hashes)
+
+        self.object_ids = self.roof_flat['object_ids']
+        self._unions = None  # (roof_union, roof_area, ground_union, ground_area), computed on the first detection
+
+    @classmethod
+    def from_file(cls, input_file, parser='auto', aoi=None, **kwargs):
+        """
+        Returns a detector of a CityJSON file
+
+        Input:
+            input_file: CityJSON file name
+            parser: JSON parser to use (see underpass_detection.load_cityjson)
+                    -> default: 'auto'
+            aoi: The area of interest returned by underpass_detection.area_of_interest (see select_area)
+                 -> default: None (every City Object)
+            **kwargs: prefilter_tol, cache_file, snap, coverage (see UnderpassDetector)
+        """
+        input_data = underpass_detection.select_area(underpass_detection.load_cityjson(input_file, parser), aoi)
+
+        return cls(input_data, **kwargs)
+
+    def unions(self):
+        """
+        Function that returns the merged roof/ground surfaces and areas of every City Object (steps 3) and 5)),
+        computed once and kept for the following detections
+
+        Output:
+            roof_union, roof_area, ground_union, ground_area: Arrays per City Object (None / NaN if it has no such surfaces)
+        """
+        if self._unions is None:
+            cache = underpass_detection.open_cache(self.cache_file) if self.cache_file is not None else None
+            try:
+                self._unions = underpass_detection.merge_surfaces(self.roof_flat, self.ground_flat, self.v_coords, self.input_data['transform'],
+                                                                  'area', cache, self.hashes, 'union', self.grid_size, self.coverage)
+            finally:
+                if cache is not None:
+                    cache.close()
+
+        return self._unions
+
+    def detect(self, eps=1e-8, method='area'):
+        """
+        Function that returns the City Objects with underpasses (step 6)
+
+        Input:
+            eps: Minimum difference between roof and ground areas (method 'area') or minimum underpass area (method 'geometry')
+                 -> default: 1e-8
+            method: 'area' (compare roof and ground areas), 'geometry' (compute the roof - ground geometry)
+                    or 'overhang' (find the roof faces without a ground face beneath them, see underpass_detection.overhang_faces)
+                    -> default: 'area'
+        Output:
+            underpasses: A table {column_name: [value, ...]} of the City Objects with underpasses
+                         - 'area': uuid, roof_area, ground_area, diff, geometry (merged roof), ground_geom (merged ground)
+                         - 'geometry': uuid, area, geometry (underpass geometry), centroid
+                         - 'overhang': uuid, area, geometry (merged overhanging roof faces), n_faces
+        """
+        if method not in underpass_detection.RESULT_COLUMNS:
+            raise ValueError(f'unknown method: {method}')
+
+        merged = self.unions() if method != 'overhang' else (None, None, None, None)  # overhang does not need the merged surfaces
+        columns, underpass, _ = underpass_detection.find_underpasses(eps, self.roof_flat, self.ground_flat, self.v_coords, merged, method)
+        nums = np.flatnonzero(underpass)
+
+        table = {'uuid': [self.object_ids[i] for i in nums]}
+        if method == 'area':
+            table.update(roof_area=merged[1][nums], ground_area=merged[3][nums])
+        for name, col in zip(underpass_detection.RESULT_COLUMNS[method], columns):
+            table[name] = col[nums]
+
+        return table
+
+    def only_roof(self):
+        """
+        Function that returns the IDs of the City Objects that have roof surfaces but no ground surfaces (for testing)
+        """
+        _, roof_area, _, ground_area = self.unions()
+        _, _, only_roof = underpass_detection.diff_area_batch(np.inf, roof_area, ground_area)
+
+        return [self.object_ids[i] for i in np.flatnonzero(only_roof)]
+
+    def outer_ceiling_surfaces(self):
+        """
+        Function that returns the merged outer ceiling surfaces of the City Objects that have them
+
+        Output:
+            ocs: A table {'uuid': [...], 'area': [...], 'geometry': [...]}
+        """
+        ocs_flat = underpass_detection.flat_boundaries(self.input_data, underpass_detection.OCS_TYPES)
+        has_ocs = np.diff(ocs_flat['object_offsets']) > 0
+        ocs_flat = underpass_detection.select_objects(ocs_flat, has_ocs)
+
+        ocs_geoms = underpass_detection.flat_polygons(ocs_flat, self.v_coords)
+        ocs_union, ocs_area = underpass_detection.cal_area_batch(ocs_geoms, underpass_detection.surface_objects(ocs_flat), len(ocs_flat['object_ids']))
+
+        return {'uuid': list(ocs_flat['object_ids']),
+                'area': ocs_area,
+                'geometry': ocs_union}
+
+    def write_geoparquet(self, table, output_file_nm):
+        """
+        Function that writes a result table of this detector to a GeoParquet file (see underpass_detection.write_geoparquet)
+        """
+        geometry_columns = [name for name in ('geometry', 'ground_geom', 'centroid') if name in table]
+
+        underpass_detection.write_geoparquet(table, geometry_columns, output_file_nm)